@@ -1,25 +1,2758 @@
+import time
+# Início da importação do módulo, para o relatório de inicialização
+STARTUP_BEGIN = time.perf_counter()
+import importlib.util
 import gi
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk, Gdk, GdkPixbuf, GLib
-from PIL import Image, ImageSequence
-import time
+from gi.repository import Gtk, Gdk, GdkPixbuf, GLib, Gio
 import threading
+import collections
+import concurrent.futures
+import multiprocessing
+import hashlib
+import mmap
+import struct
 import os
 import configparser
 import pathlib
 import sys
 import logging
-import psutil
+import logging.handlers
+import queue
+import atexit
 import signal
+import socket
+import argparse
+import json
+import tempfile
+import math
+
+def lazy_import(name, optional=False):
+    # O módulo só é carregado de fato no primeiro acesso a um atributo: com
+    # o cache em disco, o autostart mostra o GIF sem nunca carregar o PIL.
+    # Módulos opcionais ausentes viram None
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    try:
+        spec = importlib.util.find_spec(name)
+    except ModuleNotFoundError:
+        spec = None
+    if spec is None:
+        if optional:
+            return None
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+Image = lazy_import("PIL.Image")
+ImageChops = lazy_import("PIL.ImageChops")
+cairo = lazy_import("cairo")
+# Só usados pelo benchmark
+resource = lazy_import("resource")
+statistics = lazy_import("statistics")
+# Opcional: acelera a expansão de frames em paleta
+numpy = lazy_import("numpy", optional=True)
+# Só usado com decode_mode = shared
+shared_memory = lazy_import("multiprocessing.shared_memory")
+STARTUP_IMPORTED = time.perf_counter()
+
+CONFIG_DIR = os.path.expanduser("~/.gif_desklet")
+CONFIG_FILE = os.path.join(CONFIG_DIR, "gif_desklet.ini")
+INSTANCES_DIR = os.path.join(CONFIG_DIR, "instances")
+DEFAULT_INSTANCE = "default"
+
+# Log com rotação por tamanho
+LOG_FILE = os.path.join(CONFIG_DIR, "autostart.log")
+LOG_LEVELS = ["debug", "info", "warning", "error"]
+DEFAULT_LOG_LEVEL = "info"
+DEFAULT_LOG_MAX_KB = 1024
+DEFAULT_LOG_BACKUPS = 3
+# Intervalo mínimo entre mensagens repetidas de um mesmo ponto quente
+LOG_THROTTLE_SECONDS = 5.0
+
+_log_listener = None
+
+def setup_logging(level=DEFAULT_LOG_LEVEL, max_kb=DEFAULT_LOG_MAX_KB, backups=DEFAULT_LOG_BACKUPS):
+    # As threads só enfileiram os registros; uma thread de fundo formata e
+    # grava no arquivo, então o loop do GTK nunca espera pelo disco
+    global _log_listener
+    if _log_listener is not None:
+        return
+    level = level if level in LOG_LEVELS else DEFAULT_LOG_LEVEL
+    try:
+        pathlib.Path(CONFIG_DIR).mkdir(parents=True, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=max(1, max_kb) * 1024,
+                                                       backupCount=max(0, backups))
+    except OSError as e:
+        # Sem arquivo de log o desklet continua funcionando, com log no stderr
+        print(f"Failed to open log file {LOG_FILE}: {e}", file=sys.stderr)
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    root.addHandler(logging.handlers.QueueHandler(records))
+    _log_listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+_throttled = {}
+
+def log_throttled(key, level, message, interval=LOG_THROTTLE_SECONDS):
+    # Para eventos que podem se repetir a cada frame ou movimento do mouse:
+    # no máximo uma mensagem por intervalo para cada key, informando quantas
+    # foram suprimidas
+    if not logging.getLogger().isEnabledFor(level):
+        return
+    now = time.monotonic()
+    last, suppressed = _throttled.get(key, (None, 0))
+    if last is not None and now - last < interval:
+        _throttled[key] = (last, suppressed + 1)
+        return
+    _throttled[key] = (now, 0)
+    if suppressed:
+        message = f"{message} ({suppressed} similar message(s) suppressed)"
+    logging.log(level, message)
+
+# Limites padrão da janela de frames decodificados
+DEFAULT_FRAMES_AHEAD = 8
+DEFAULT_FRAME_MEMORY_MB = 64
+DEFAULT_PALETTE_MEMORY_MB = 64
+DEFAULT_PIXBUF_CACHE_MB = 128
+DEFAULT_DISK_CACHE_MB = 256
+# Teto do diretório de cache em disco inteiro, somando todas as entradas
+DEFAULT_DISK_CACHE_TOTAL_MB = 1024
+# Teto de memória de frames do processo inteiro, somando todos os desklets
+DEFAULT_MEMORY_BUDGET_MB = 512
+CACHE_DIR = os.path.join(CONFIG_DIR, "cache")
+RENDER_MODES = ["full", "delta"]
+# Além destes, "loops" aceita um número de voltas
+LOOP_MODES = ["forever", "file"]
+# Espera, após a última mudança no GIF observado, antes de recarregá-lo
+WATCH_DELAY_MS = 300
+# Nomes das constantes do PIL, resolvidas só ao redimensionar
+RESAMPLE_FILTERS = {
+    "nearest": "NEAREST",
+    "box": "BOX",
+    "bilinear": "BILINEAR",
+    "hamming": "HAMMING",
+    "bicubic": "BICUBIC",
+    "lanczos": "LANCZOS",
+}
+
+class FrameScaling:
+    # Tamanho de exibição de um desklet, aplicado uma única vez na decodificação
+    # para que os frames sejam guardados e desenhados já no tamanho final.
+    # device_scale é o fator de escala do monitor (HiDPI)
+    def __init__(self, scale=1.0, width=0, height=0, resample="lanczos", device_scale=1):
+        self.scale = scale if scale > 0 else 1.0
+        self.width = max(0, width)
+        self.height = max(0, height)
+        self.resample = resample if resample in RESAMPLE_FILTERS else "lanczos"
+        self.device_scale = max(1, device_scale)
+
+    def logical_size(self, src_size):
+        w, h = src_size
+        if self.width and self.height:
+            # Caber na caixa pedida mantendo a proporção
+            ratio = min(self.width / w, self.height / h)
+        elif self.width:
+            ratio = self.width / w
+        elif self.height:
+            ratio = self.height / h
+        else:
+            ratio = self.scale
+        return (max(1, round(w * ratio)), max(1, round(h * ratio)))
+
+    def output_size(self, src_size):
+        # Nunca acima da resolução do arquivo: ampliar só gasta memória. O que
+        # faltar da escala fica com a superfície cairo na hora de desenhar
+        w, h = self.logical_size(src_size)
+        return (min(src_size[0], w * self.device_scale), min(src_size[1], h * self.device_scale))
+
+    def apply(self, image, size):
+        if image.size == size:
+            return image
+        return image.resize(size, getattr(Image, RESAMPLE_FILTERS[self.resample]))
+
+    def key(self):
+        return f"{self.scale}:{self.width}x{self.height}:{self.resample}@{self.device_scale}"
+
+def frame_delta(previous, current, box):
+    # Retângulo (x, y, w, h) que mudou entre dois frames já compostos,
+    # procurado apenas dentro de box (x0, y0, x1, y1)
+    diff = ImageChops.difference(previous.crop(box), current.crop(box))
+    changed = None
+    for band in diff.split():
+        band_box = band.getbbox()
+        if band_box is not None:
+            changed = band_box if changed is None else union_box(changed, band_box)
+    if changed is None:
+        return (0, 0, 0, 0)
+    return (box[0] + changed[0], box[1] + changed[1], changed[2] - changed[0], changed[3] - changed[1])
+
+def union_box(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def union_rect(a, b):
+    if not a[2] or not a[3]:
+        return b
+    if not b[2] or not b[3]:
+        return a
+    x0, y0, x1, y1 = union_box((a[0], a[1], a[0] + a[2], a[1] + a[3]), (b[0], b[1], b[0] + b[2], b[1] + b[3]))
+    return (x0, y0, x1 - x0, y1 - y0)
+
+class FrameDiffer:
+    # Calcula a região alterada de cada frame em relação ao anterior durante a
+    # decodificação sequencial. O descarte (fundo/anterior) já vem aplicado pelo
+    # PIL nos frames compostos, e a busca fica limitada à área do frame atual
+    # somada à área descartada do frame anterior
+    def __init__(self, frame_count, size, scaled=False):
+        self.frame_count = frame_count
+        self.full_box = (0, 0, size[0], size[1])
+        # Em frames redimensionados as áreas do GIF não correspondem mais aos pixels
+        self.scaled = scaled
+        self.previous = None
+
+    def feed(self, index, image, extent):
+        rect = None
+        if self.previous is not None:
+            prev_index, prev_image, prev_extent = self.previous
+            if prev_index == (index - 1) % self.frame_count:
+                # Ao voltar para o frame 0 o PIL recomeça a composição do zero
+                if index == 0 or self.scaled:
+                    box = self.full_box
+                else:
+                    box = union_box(prev_extent, extent or self.full_box)
+                rect = frame_delta(prev_image, image, box)
+        self.previous = (index, image, extent or self.full_box)
+        return rect
+
+class FrameVisibility:
+    # Quais frames chegam a ser exibidos sob um limite de FPS: um frame que
+    # começaria menos de min_interval_ms (em tempo do GIF) depois do último
+    # exibido é fundido a ele. O frame 0 é sempre exibido. Calculado aos
+    # poucos, à medida que as durações ficam conhecidas
+    def __init__(self, frame_count, min_interval_ms=0):
+        self.min_interval_ms = min_interval_ms
+        self.visible = [None] * frame_count
+        self.next = 0
+        self.elapsed = 0
+
+    def update(self, durations):
+        if self.min_interval_ms <= 0:
+            return
+        while self.next < len(self.visible):
+            index = self.next
+            if index:
+                if durations[index - 1] is None:
+                    break
+                self.elapsed += clamp_frame_delay(durations[index - 1])
+            shown = index == 0 or self.elapsed >= self.min_interval_ms
+            self.visible[index] = shown
+            if shown:
+                self.elapsed = 0
+            self.next += 1
+
+    def is_visible(self, index):
+        # Frames ainda não avaliados contam como visíveis
+        return self.min_interval_ms <= 0 or self.visible[index] is not False
+
+class PaletteFrame:
+    # Frame guardado como índices de 8 bits mais a paleta RGBA (256 x 4 bytes),
+    # um quarto da memória do frame expandido
+    __slots__ = ("indices", "palette")
+
+    def __init__(self, indices, palette):
+        self.indices = indices
+        self.palette = palette
+
+    @classmethod
+    def from_image(cls, image, palettes):
+        colors = image.getpalette() or []
+        colors = colors + [0] * (768 - len(colors))
+        transparency = image.info.get("transparency")
+        palette = bytearray(1024)
+        for i in range(256):
+            palette[i * 4:i * 4 + 3] = bytes(colors[i * 3:i * 3 + 3])
+            palette[i * 4 + 3] = 0 if i == transparency else 255
+        # Frames com a mesma paleta compartilham o mesmo buffer
+        palette = palettes.setdefault(bytes(palette), bytes(palette))
+        return cls(image.tobytes(), palette)
+
+    def nbytes(self):
+        return len(self.indices)
+
+    def expand(self, size):
+        # Consulta vetorizada na paleta: NumPy quando disponível, senão o convert() do PIL
+        if numpy is not None:
+            table = numpy.frombuffer(self.palette, dtype=numpy.uint8).reshape(256, 4)
+            return table[numpy.frombuffer(self.indices, dtype=numpy.uint8)].tobytes()
+        image = Image.frombuffer("P", size, self.indices, "raw", "P", 0, 1)
+        image.putpalette(self.palette, "RGBA")
+        return image.convert("RGBA").tobytes()
+
+class FrameDecoder:
+    # Interface dos decodificadores: abre um arquivo animado e entrega cada
+    # frame já composto em RGBA. Cada backend declara suas capacidades
+    name = None
+    extensions = ()
+    signatures = ()
+    # seek() para trás sem redecodificar desde o início
+    random_access = False
+    # frame_count conhecido sem decodificar os pixels
+    cheap_frame_count = False
+    # Alfa de 8 bits; sem ele a transparência é só ligada/desligada
+    native_alpha = False
+    # read() pode devolver o frame em paleta (PaletteFrame)
+    palette_frames = False
+
+    def __init__(self, path):
+        self.path = path
+        self.size = (0, 0)
+        self.frame_count = 1
+        self.loop_count = None
+
+    @classmethod
+    def sniff(cls, header):
+        return any(header.startswith(signature) for signature in cls.signatures)
+
+    @classmethod
+    def capabilities(cls):
+        return {
+            "name": cls.name,
+            "random_access": cls.random_access,
+            "cheap_frame_count": cls.cheap_frame_count,
+            "native_alpha": cls.native_alpha,
+            "palette_frames": cls.palette_frames,
+        }
+
+    @classmethod
+    def plays_for(cls, loop):
+        # Total de voltas para a contagem de repetições do arquivo, ou None para
+        # repetir sempre. Em APNG (num_plays) e WebP (loop_count) ela já é o
+        # total; sem contagem a animação toca uma vez
+        if loop is None:
+            return 1
+        return None if loop == 0 else loop
+
+    def read(self, index, palettes=None):
+        # Devolve (duração em ms, área do frame ou None, Image RGBA, PaletteFrame ou None)
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class PilDecoder(FrameDecoder):
+    # Base dos formatos que o PIL abre como imagem com vários frames
+    # (seek()/n_frames); voltar a um frame anterior recomeça do início
+    def __init__(self, path):
+        super().__init__(path)
+        self.image = self.open_image(path)
+        self.size = self.image.size
+        self.frame_count = getattr(self.image, "n_frames", 1)
+        self.image.seek(0)
+        self.loop_count = self.image.info.get("loop")
+
+    def open_image(self, path):
+        return Image.open(path)
+
+    def read(self, index, palettes=None):
+        self.image.seek(index)
+        duration = int(round(self.image.info.get("duration") or 100))
+        extent = getattr(self.image, "dispose_extent", None)
+        compact = None
+        if palettes is not None and self.palette_frames and self.image.mode == "P":
+            compact = PaletteFrame.from_image(self.image, palettes)
+        return duration, extent, self.image.convert("RGBA"), compact
+
+    def close(self):
+        self.image.close()
+
+class GifDecoder(PilDecoder):
+    name = "gif"
+    extensions = (".gif",)
+    signatures = (b"GIF87a", b"GIF89a")
+    # n_frames percorre apenas os cabeçalhos dos blocos
+    cheap_frame_count = True
+    palette_frames = True
+
+    def open_image(self, path):
+        # Manter os frames em modo P enquanto a paleta não muda (Pillow >= 9.1); por
+        # padrão o PIL converte para RGB(A) tudo que vem depois do primeiro frame
+        from PIL import GifImagePlugin
+        if hasattr(GifImagePlugin, "LoadingStrategy"):
+            GifImagePlugin.LOADING_STRATEGY = GifImagePlugin.LoadingStrategy.RGB_AFTER_DIFFERENT_PALETTE_ONLY
+        return Image.open(path)
+
+    @classmethod
+    def plays_for(cls, loop):
+        # A extensão NETSCAPE conta as repetições depois da primeira volta
+        if loop is None:
+            return 1
+        return None if loop == 0 else loop + 1
+
+class WebPDecoder(PilDecoder):
+    # WebP animado; exige o PIL compilado com libwebp
+    name = "webp"
+    extensions = (".webp",)
+    cheap_frame_count = True
+    native_alpha = True
+
+    @classmethod
+    def sniff(cls, header):
+        return header[:4] == b"RIFF" and header[8:12] == b"WEBP"
+
+class ApngDecoder(PilDecoder):
+    # PNG animado; um PNG comum é tratado como animação de um frame
+    name = "apng"
+    extensions = (".png", ".apng")
+    signatures = (b"\x89PNG\r\n\x1a\n",)
+    # O número de frames vem do chunk acTL
+    cheap_frame_count = True
+    native_alpha = True
+
+DECODERS = [GifDecoder, WebPDecoder, ApngDecoder]
+
+def decoder_class(path):
+    # Pela assinatura do arquivo; a extensão só decide se ela não for reconhecida
+    with open(path, "rb") as f:
+        header = f.read(16)
+    for cls in DECODERS:
+        if cls.sniff(header):
+            return cls
+    extension = os.path.splitext(path)[1].lower()
+    for cls in DECODERS:
+        if extension in cls.extensions:
+            return cls
+    raise ValueError(f"Unsupported animation format: {path}")
+
+def open_decoder(path):
+    return decoder_class(path)(path)
+
+# Um decodificador aberto por arquivo (e versão do arquivo) em cada processo,
+# compartilhado pelo FrameSource e pelos workers de thread: o arquivo é aberto
+# e seus cabeçalhos percorridos uma única vez. A entrada também guarda um
+# FrameDiffer por escala, que segue o decodificador entre blocos
+_worker_images = {}
+_worker_images_lock = threading.Lock()
+
+def acquire_shared_image(gif_path):
+    stat = os.stat(gif_path)
+    key = (os.path.realpath(gif_path), stat.st_size, stat.st_mtime_ns)
+    with _worker_images_lock:
+        entry = _worker_images.get(key)
+        if entry is None:
+            entry = _worker_images[key] = [open_decoder(gif_path), threading.Lock(), 0, {}]
+        entry[2] += 1
+    return key, entry
+
+def release_shared_image(key, entry, close):
+    # Fechar o arquivo se ninguém mais o estiver usando
+    with _worker_images_lock:
+        entry[2] -= 1
+        if entry[2] == 0 and close:
+            if _worker_images.get(key) is entry:
+                del _worker_images[key]
+            entry[0].close()
+
+def release_animation(gif_path):
+    # Executado no worker quando o processo do GTK não tem mais frames do
+    # arquivo: fecha os decodificadores dele que ficaram abertos
+    path = os.path.realpath(gif_path)
+    with _worker_images_lock:
+        for key in [key for key, entry in _worker_images.items() if key[0] == path and entry[2] == 0]:
+            _worker_images.pop(key)[0].close()
+
+class SharedFrameSlots:
+    # Bloco de memória compartilhada com espaço para alguns frames RGBA. No
+    # modo "shared" os workers escrevem os pixels aqui e só os metadados
+    # voltam pelo pipe do pool; o frame i do bloco ocupa o slot i
+    def __init__(self, slots, frame_bytes):
+        self.slots = max(1, slots)
+        self.frame_bytes = frame_bytes
+        self.memory = shared_memory.SharedMemory(create=True, size=max(1, self.slots * frame_bytes))
+        self.name = self.memory.name
+
+    def read(self, slot):
+        offset = slot * self.frame_bytes
+        return bytes(self.memory.buf[offset:offset + self.frame_bytes])
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+def attach_shared_slots(name):
+    # O bloco pertence ao processo do GTK, que o remove; o worker não deve
+    # registrá-lo no resource tracker (track só existe no Python >= 3.13)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+class AnimationInfo:
+    # O que se sabe de uma animação só pelos cabeçalhos; pode atravessar o
+    # pipe do pool de processos
+    def __init__(self, decoder):
+        self.name = decoder.name
+        self.capabilities = decoder.capabilities()
+        self.size = decoder.size
+        self.frame_count = decoder.frame_count
+        self.loop_count = decoder.loop_count
+        self.plays = decoder.plays_for(decoder.loop_count)
+        self.palette_frames = decoder.palette_frames
+
+def probe_animation(gif_path):
+    # Lê só os cabeçalhos. O decodificador continua aberto no processo para o
+    # FrameSource ou os blocos que vêm em seguida
+    key, entry = acquire_shared_image(gif_path)
+    try:
+        with entry[1]:
+            return AnimationInfo(entry[0])
+    finally:
+        release_shared_image(key, entry, False)
+
+def decode_chunk(gif_path, start, count, scaling, slots_name=None):
+    # Executado em um worker do DecodePool (thread ou processo): decodifica os
+    # frames [start, start + count) e devolve (frames, regiões alteradas por
+    # índice). O decodificador fica aberto entre blocos consecutivos, para que
+    # o seek() seguinte só avance. Com slots_name os pixels vão para a memória
+    # compartilhada e o frame volta com data None
+    key, entry = acquire_shared_image(gif_path)
+    decoder, lock, differs = entry[0], entry[1], entry[3]
+    slots = attach_shared_slots(slots_name) if slots_name else None
+
+    frames = []
+    rects = {}
+    finished = True
+    try:
+        with lock:
+            frame_count = decoder.frame_count
+            size = scaling.output_size(decoder.size)
+            palettes = {} if size == decoder.size else None
+            differ = differs.get(scaling.key())
+            if differ is None:
+                differ = differs[scaling.key()] = FrameDiffer(frame_count, size, scaled=size != decoder.size)
+            if start and (differ.previous is None or differ.previous[0] != start - 1):
+                # O bloco anterior foi para outro worker: a região do primeiro
+                # frame deste é relativa ao último daquele
+                _, extent, rgba, _ = decoder.read(start - 1)
+                differ.feed(start - 1, scaling.apply(rgba, size), extent)
+            for index in range(start, min(start + count, frame_count)):
+                started = time.perf_counter()
+                duration, extent, rgba, compact = decoder.read(index, palettes)
+                image = scaling.apply(rgba, size)
+                rect = differ.feed(index, image, extent)
+                if rect is not None:
+                    rects[index] = rect
+                data = image.tobytes()
+                if slots is not None:
+                    offset = (index - start) * len(data)
+                    slots.buf[offset:offset + len(data)] = data
+                    data = None
+                frames.append((index, duration, extent, data, compact, time.perf_counter() - started))
+            finished = start + count >= frame_count
+            if finished and frame_count > 1:
+                # A região do frame 0 é relativa ao último frame do loop
+                _, _, rgba, _ = decoder.read(0)
+                rects[0] = differ.feed(0, scaling.apply(rgba, size), None)
+    finally:
+        # Ao chegar ao fim do arquivo ele pode ser fechado
+        release_shared_image(key, entry, finished)
+        if slots is not None:
+            slots.close()
+    return frames, rects
+
+class FrameSource:
+    # Decodifica os frames sob demanda, mantendo em memória apenas uma janela
+    # limitada à frente do cursor de reprodução. Com um DecodePool, a
+    # decodificação acontece em segundo plano e a thread do GTK só recebe os
+    # frames prontos. Com info (cabeçalhos lidos num worker do pool de
+    # processos) nenhum decodificador é aberto neste processo: um frame que
+    # ainda não chegou do pool faz get_frame() devolver None
+    FIRST_CHUNK = 1
+    CHUNK = 8
+    # Blocos perdidos por queda de um worker antes de desistir do segundo plano
+    MAX_CRASHES = 3
+
+    def __init__(self, gif_path, frames_ahead=DEFAULT_FRAMES_AHEAD, frame_memory_mb=DEFAULT_FRAME_MEMORY_MB,
+                 scaling=None, palette_memory_mb=DEFAULT_PALETTE_MEMORY_MB, min_interval_ms=0, info=None):
+        self.gif_path = gif_path
+        self.scaling = scaling or FrameScaling()
+        # Reentrante: um bloco que já terminou quando _submit() registra o
+        # callback é processado na hora, pela mesma thread que segura o lock
+        self.lock = threading.RLock()
+        self.closed = False
+
+        self.decoder = self.image_key = self.image_entry = None
+        if info is None:
+            try:
+                self.image_key, self.image_entry = acquire_shared_image(gif_path)
+            except Exception as e:
+                logging.error(f"Failed to open animation {gif_path}: {e}")
+                raise
+            self.decoder, self.image_lock = self.image_entry[0], self.image_entry[1]
+            with self.image_lock:
+                info = AnimationInfo(self.decoder)
+        self.decoder_name = info.name
+        self.source_size = info.size
+        self.frame_count = info.frame_count
+        # Contagem de repetições do arquivo (NETSCAPE, acTL, ANIM); None se ausente
+        self.loop_count = info.loop_count
+        # Total de voltas que o arquivo pede, já no significado do formato
+        self.plays = info.plays
+        # Tamanho na tela em pixels lógicos; size é o dos frames guardados
+        self.logical_size = self.scaling.logical_size(self.source_size)
+        self.size = self.scaling.output_size(self.source_size)
+        self.durations = [None] * self.frame_count
+        self.dirty_rects = [None] * self.frame_count
+        # Frames que o limite de FPS nunca mostra não são guardados nem convertidos
+        self.visibility = FrameVisibility(self.frame_count, min_interval_ms)
+        scaled = self.size != self.source_size
+        self.differ = FrameDiffer(self.frame_count, self.size, scaled=scaled)
+
+        # A janela respeita tanto o número de frames quanto o teto de memória
+        self.frame_bytes = self.size[0] * self.size[1] * 4
+        max_bytes = int(max(0, frame_memory_mb) * 1024 * 1024)
+        self.max_frames = max(1, min(frames_ahead, max_bytes // max(1, self.frame_bytes)))
+        self.ring = collections.OrderedDict()
+        # Posição de cada consumidor (desklet) que exibe estes frames: cada um
+        # tem sua janela, e as janelas dividem max_frames entre si
+        self.cursors = {}
+
+        # Todos os frames ficam residentes em forma compacta (paleta) enquanto
+        # couberem; só a janela acima é expandida para RGBA. Frames
+        # redimensionados já não são indexados e ficam de fora
+        self.compact = {}
+        self.palettes = {}
+        self.compact_bytes = 0
+        self.max_compact_bytes = 0
+        if info.palette_frames and not scaled:
+            self.max_compact_bytes = int(max(0, palette_memory_mb) * 1024 * 1024)
+
+        # Decodificação em segundo plano
+        self.pool = None
+        self.pending = None
+        self.shared = None
+        self.crashes = 0
+        self.decoded = set()
+        self.waiters = {}
+        self.progress_listeners = []
+        # complete_listeners só são chamados no sucesso; complete_waiters
+        # (when_complete) também quando a decodificação falha
+        self.complete_listeners = []
+        self.complete_waiters = []
+        # Mensagem da falha que interrompeu a decodificação em segundo plano
+        self.error = None
+
+        # Tempo gasto decodificando, somando a thread do GTK e os workers
+        self.decode_seconds = 0.0
+        self.decode_count = 0
+
+        logging.debug(f"FrameSource for {gif_path}: decoder={info.capabilities}, size={self.size}, "
+                      f"frames={self.frame_count}, window={self.max_frames} frames")
+
+    def get_duration(self, index):
+        # None enquanto o frame não chega do pool (clamp_frame_delay usa 100 ms)
+        with self.lock:
+            if self.durations[index] is None and self.decoder is not None:
+                self._decode(index)
+            return self.durations[index]
+
+    def get_dirty_rect(self, index):
+        # None quando a região ainda não é conhecida
+        return self.dirty_rects[index]
+
+    def is_visible(self, index):
+        return self.visibility.is_visible(index)
+
+    def get_frame(self, index, consumer=None):
+        with self.lock:
+            self.cursors[consumer] = index
+            data = self.ring.get(index)
+            if data is None:
+                data = self._decode(index)
+            self._prefetch(index)
+            return data
+
+    def forget(self, consumer):
+        # O consumidor parou de exibir estes frames: sua janela deixa de contar
+        with self.lock:
+            self.cursors.pop(consumer, None)
+
+    def preload(self, pool):
+        # Percorre o GIF inteiro uma vez no pool, em blocos sequenciais; o
+        # primeiro bloco tem um único frame para que ele apareça o quanto antes
+        with self.lock:
+            self.pool = pool
+            if pool.mode == "shared":
+                try:
+                    self.shared = SharedFrameSlots(min(self.CHUNK, self.max_frames), self.frame_bytes)
+                except OSError as e:
+                    logging.warning(f"Shared memory unavailable for {self.gif_path}, sending frames through the pool: {e}")
+            self._submit(0, self.FIRST_CHUNK, preload=True)
+
+    def when_ready(self, index, callback):
+        # Chama callback na thread do GTK assim que o frame puder ser exibido
+        # sem decodificar na hora, ou quando a decodificação falhar (self.error)
+        with self.lock:
+            ready = self.pool is None or self.error is not None or index in self.ring or index in self.compact
+            if not ready:
+                self.waiters.setdefault(index, []).append(callback)
+        if ready:
+            callback()
+
+    def add_progress_listener(self, callback):
+        # callback(decodificados, total), sempre na thread do GTK
+        self.progress_listeners.append(callback)
+        decoded, total = len(self.decoded), self.frame_count
+        GLib.idle_add(callback, decoded, total)
+
+    def add_complete_listener(self, callback):
+        self.complete_listeners.append(callback)
+
+    def when_complete(self, callback):
+        # Chama callback na thread do GTK quando todos os frames tiverem sido
+        # decodificados ou a decodificação falhar (self.error); sem pool, os
+        # frames são decodificados sob demanda
+        with self.lock:
+            complete = self.pool is None or self.error is not None or len(self.decoded) >= self.frame_count
+            if not complete:
+                self.complete_waiters.append(callback)
+        if complete:
+            callback()
+
+    def memory_usage(self):
+        with self.lock:
+            return sum(len(data) for data in self.ring.values()) + self.compact_bytes
+
+    def close(self):
+        with self.lock:
+            # O decodificador compartilhado só pode ser liberado uma vez
+            if self.closed:
+                return
+            self.closed = True
+            if self.pending is not None:
+                self.pending.cancel()
+            self.ring.clear()
+            self.compact.clear()
+            self.palettes.clear()
+            self.waiters.clear()
+            self.complete_waiters = []
+            if self.shared is not None:
+                self.shared.close()
+                self.shared = None
+            if self.image_entry is not None:
+                release_shared_image(self.image_key, self.image_entry, True)
+
+    def _window(self, index, size):
+        # Os próximos size frames que podem ser exibidos
+        window = []
+        for step in range(self.frame_count):
+            i = (index + step) % self.frame_count
+            if step == 0 or self.visibility.is_visible(i):
+                window.append(i)
+                if len(window) >= size:
+                    break
+        return window
+
+    def _window_size(self):
+        return max(1, self.max_frames // max(1, len(self.cursors)))
+
+    def _kept(self):
+        # Frames que a janela de algum consumidor ainda vai exibir; antes do
+        # primeiro get_frame(), a janela a partir do frame 0
+        size = self._window_size()
+        kept = set()
+        for cursor in (self.cursors or {None: 0}).values():
+            kept.update(self._window(cursor, size))
+        return kept
+
+    def _decode(self, index):
+        compact = self.compact.get(index)
+        if compact is not None:
+            data = compact.expand(self.size)
+            self.ring[index] = data
+            return data
+        if self.decoder is None:
+            return None
+
+        # seek() para trás volta ao início do arquivo; em reprodução sequencial só avança
+        started = time.perf_counter()
+        with self.image_lock:
+            palettes = self.palettes if self.max_compact_bytes else None
+            duration, extent, image, compact = self.decoder.read(index, palettes)
+            self.durations[index] = duration
+            self.visibility.update(self.durations)
+            image = self.scaling.apply(image, self.size)
+        if not self.visibility.is_visible(index):
+            compact = None
+        rect = self.differ.feed(index, image, extent)
+        if rect is not None:
+            self.dirty_rects[index] = rect
+        data = image.tobytes()
+        self.ring[index] = data
+        self.decoded.add(index)
+        if compact is not None:
+            self._store_compact(index, compact)
+        self.decode_seconds += time.perf_counter() - started
+        self.decode_count += 1
+        return data
+
+    def _store_compact(self, index, frame):
+        if index in self.compact or self.compact_bytes + frame.nbytes() > self.max_compact_bytes:
+            return
+        # Frames com a mesma paleta compartilham o mesmo buffer
+        frame.palette = self.palettes.setdefault(frame.palette, frame.palette)
+        self.compact[index] = frame
+        self.compact_bytes += frame.nbytes()
+
+    def _prefetch(self, index):
+        window = self._window(index, self._window_size())
+        # Descartar frames que ficaram para trás de todos os cursores
+        kept = self._kept()
+        for old in [i for i in self.ring if i not in kept]:
+            del self.ring[old]
+        missing = []
+        for i in window:
+            if i in self.ring:
+                continue
+            if i in self.compact or (self.pool is None and self.decoder is not None):
+                self._decode(i)
+            else:
+                missing.append(i)
+        # Frames que precisam voltar ao GIF são decodificados no pool, junto
+        # com os frames ocultos entre eles
+        if missing and self.pending is None and self.error is None:
+            self._submit(missing[0], (window[-1] - missing[0]) % self.frame_count + 1, preload=False)
+
+    def _submit(self, start, count, preload):
+        count = min(count, self.frame_count - start)
+        slots_name = None
+        if self.shared is not None:
+            # Um bloco nunca passa do número de slots; o restante vai no próximo
+            count = min(count, self.shared.slots)
+            slots_name = self.shared.name
+        self.pending = self.pool.submit(decode_chunk, self.gif_path, start, count, self.scaling, slots_name,
+                                        affinity=self.gif_path)
+        self.pending.add_done_callback(lambda future: self._ingest(future, start, count, preload))
+
+    def _ingest(self, future, start, count, preload):
+        # Roda na thread do worker (ou na thread de gerenciamento do pool de processos)
+        if future.cancelled():
+            return
+        try:
+            frames, rects = future.result()
+        except concurrent.futures.BrokenExecutor as e:
+            # O worker morreu no meio do bloco (crash no decodificador): o
+            # desklet continua com os frames que já tem e o bloco é tentado de
+            # novo num pool recriado, até MAX_CRASHES vezes
+            with self.lock:
+                self.pending = None
+                self.crashes += 1
+                crashes = self.crashes
+                if preload and not self.closed and crashes <= self.MAX_CRASHES:
+                    self._submit(start, count, preload=True)
+            logging.error(f"Decode worker crashed on {self.gif_path} frames {start}-{start + count - 1} "
+                          f"({crashes}/{self.MAX_CRASHES}): {e}")
+            if crashes > self.MAX_CRASHES:
+                self._fail(f"decode worker crashed {crashes} times")
+            return
+        except Exception as e:
+            logging.error(f"Background decode of {self.gif_path} frames {start}-{start + count - 1} failed: {e}")
+            self._fail(str(e) or type(e).__name__)
+            return
+
+        ready = []
+        with self.lock:
+            if self.closed:
+                return
+            self.pending = None
+            for index, duration, extent, data, compact, elapsed in frames:
+                self.durations[index] = duration
+            self.visibility.update(self.durations)
+            for index, rect in rects.items():
+                self.dirty_rects[index] = rect
+            window = self._kept()
+            for index, duration, extent, data, compact, elapsed in frames:
+                if data is None:
+                    data = self.shared.read(index - start)
+                self.decode_seconds += elapsed
+                self.decode_count += 1
+                visible = self.visibility.is_visible(index)
+                if compact is not None and visible:
+                    self._store_compact(index, compact)
+                if (index in window and visible) or index in self.waiters:
+                    self.ring[index] = data
+                self.decoded.add(index)
+                ready.extend(self.waiters.pop(index, []))
+
+            next_start = start + count
+            finished = preload and next_start >= self.frame_count
+            if preload and not finished:
+                self._submit(next_start, self.CHUNK, preload=True)
+            decoded, total = len(self.decoded), self.frame_count
+
+        for callback in ready:
+            GLib.idle_add(callback)
+        for callback in self.progress_listeners:
+            GLib.idle_add(callback, decoded, total)
+        if finished:
+            logging.debug(f"Background decode of {self.gif_path} finished ({total} frames)")
+            with self.lock:
+                waiters, self.complete_waiters = self.complete_waiters, []
+            for callback in self.complete_listeners + waiters:
+                GLib.idle_add(callback)
+
+    def _fail(self, message):
+        # Nenhum frame novo vai chegar: quem espera é chamado assim mesmo e
+        # confere self.error
+        with self.lock:
+            self.pending = None
+            if self.closed or self.error is not None:
+                return
+            self.error = message
+            callbacks = [callback for waiting in self.waiters.values() for callback in waiting]
+            callbacks += self.complete_waiters
+            self.waiters.clear()
+            self.complete_waiters = []
+        for callback in callbacks:
+            GLib.idle_add(callback)
+
+class CachedFrameSource:
+    # Frames RGBA servidos diretamente de um arquivo de cache mapeado com mmap.
+    # mapped é o mesmo arquivo mapeado pelo GLib: os pixbufs são criados sobre
+    # as páginas dele, sem copiar os pixels
+    def __init__(self, gif_path, mapping, size, durations, dirty_rects, data_offset, digest=None,
+                 loop_count=None, min_interval_ms=0, mapped=None, logical_size=None, source_size=None, plays=1):
+        self.gif_path = gif_path
+        # Hash do GIF de origem gravado no cache
+        self.digest = digest
+        self.loop_count = loop_count
+        self.plays = plays
+        self.map = mapping
+        self.view = memoryview(mapping)
+        self.mapped_bytes = mapped.get_bytes() if mapped is not None else None
+        self.size = size
+        self.logical_size = logical_size or size
+        self.source_size = source_size or size
+        self.frame_count = len(durations)
+        self.durations = durations
+        self.dirty_rects = dirty_rects
+        self.visibility = FrameVisibility(self.frame_count, min_interval_ms)
+        self.visibility.update(durations)
+        self.frame_bytes = size[0] * size[1] * 4
+        self.data_offset = data_offset
+        # Nenhum decodificador: os frames já estão prontos no arquivo
+        self.decoder_name = "disk-cache"
+        self.error = None
+        self.decode_seconds = 0.0
+        self.decode_count = 0
+
+    def get_duration(self, index):
+        return self.durations[index]
+
+    def get_dirty_rect(self, index):
+        return self.dirty_rects[index]
+
+    def is_visible(self, index):
+        return self.visibility.is_visible(index)
+
+    def get_frame(self, index, consumer=None):
+        # Fatia do mapeamento, sem cópia
+        start = self.data_offset + index * self.frame_bytes
+        return self.view[start:start + self.frame_bytes]
+
+    def get_frame_bytes(self, index):
+        start = self.data_offset + index * self.frame_bytes
+        if self.mapped_bytes is None:
+            return GLib.Bytes.new(self.map[start:start + self.frame_bytes])
+        return GLib.Bytes.new_from_bytes(self.mapped_bytes, start, self.frame_bytes)
+
+    def forget(self, consumer):
+        pass
+
+    def when_ready(self, index, callback):
+        callback()
+
+    def add_progress_listener(self, callback):
+        GLib.idle_add(callback, self.frame_count, self.frame_count)
+
+    def add_complete_listener(self, callback):
+        pass
+
+    def when_complete(self, callback):
+        callback()
+
+    def memory_usage(self):
+        # As páginas pertencem ao page cache do kernel, não ao processo
+        return 0
+
+    def close(self):
+        # Pixbufs ainda vivos seguram o GBytes, que desfaz o mapeamento do GLib
+        # quando o último deles sair
+        self.mapped_bytes = None
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # Uma fatia de get_frame() ainda em uso; o mmap é desfeito com ela
+            logging.debug(f"Disk cache mapping for {self.gif_path} still in use, closing it later")
+
+class RescaledFrameSource:
+    # Frames de outra fonte redimensionados sob demanda: acompanha uma mudança
+    # de escala do monitor sem reabrir nem redecodificar o GIF. A fonte base
+    # continua sendo do FrameStore, sob base_key
+    def __init__(self, base, base_key, size, resample="lanczos"):
+        self.base = base
+        self.base_key = base_key
+        self.gif_path = base.gif_path
+        self.loop_count = base.loop_count
+        self.plays = base.plays
+        self.logical_size = base.logical_size
+        self.source_size = base.source_size
+        self.size = size
+        self.frame_count = base.frame_count
+        self.visibility = base.visibility
+        self.resample = resample if resample in RESAMPLE_FILTERS else "lanczos"
+        self.ratio = (size[0] / base.size[0], size[1] / base.size[1])
+        # Alcance do filtro de reamostragem, em pixels do tamanho novo
+        self.pad = int(3 * max(1.0, *self.ratio)) + 1
+        self.decoder_name = f"{base.decoder_name}+rescaled"
+        self.decode_seconds = 0.0
+        self.decode_count = 0
+
+    def get_duration(self, index):
+        return self.base.get_duration(index)
+
+    def get_dirty_rect(self, index):
+        rect = self.base.get_dirty_rect(index)
+        if rect is None or not (rect[2] and rect[3]):
+            return rect
+        x, y, w, h = rect
+        rx, ry = self.ratio
+        x0 = max(0, int(x * rx) - self.pad)
+        y0 = max(0, int(y * ry) - self.pad)
+        x1 = min(self.size[0], int((x + w) * rx) + 1 + self.pad)
+        y1 = min(self.size[1], int((y + h) * ry) + 1 + self.pad)
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def is_visible(self, index):
+        return self.base.is_visible(index)
+
+    @property
+    def error(self):
+        return self.base.error
+
+    def get_frame(self, index, consumer=None):
+        data = self.base.get_frame(index, consumer)
+        if data is None:
+            return None
+        started = time.perf_counter()
+        image = Image.frombuffer("RGBA", self.base.size, data, "raw", "RGBA", 0, 1)
+        data = image.resize(self.size, getattr(Image, RESAMPLE_FILTERS[self.resample])).tobytes()
+        self.decode_seconds += time.perf_counter() - started
+        self.decode_count += 1
+        return data
+
+    def forget(self, consumer):
+        self.base.forget(consumer)
+
+    def when_ready(self, index, callback):
+        self.base.when_ready(index, callback)
+
+    def add_progress_listener(self, callback):
+        self.base.add_progress_listener(callback)
+
+    def add_complete_listener(self, callback):
+        self.base.add_complete_listener(callback)
+
+    def when_complete(self, callback):
+        self.base.when_complete(callback)
+
+    def memory_usage(self):
+        # Os frames guardados são os da fonte base; aqui só há pixbufs
+        return 0
+
+    def close(self):
+        pass
+
+class DiskFrameCache:
+    # Cache persistente em ~/.gif_desklet/cache: cabeçalho, tabela de durações,
+    # tabela de regiões alteradas, os frames já convertidos para RGBA e, no
+    # fim, o caminho do GIF de origem
+    MAGIC = b"GIFDKC06"
+    # ..., hash do GIF de origem, contagem de repetições (-1 se ausente), total
+    # de voltas (0 para sempre), tamanho lógico, tamanho do GIF de origem e
+    # comprimento do caminho dele
+    HEADER = struct.Struct("<8sIIIQQ32siIIIIII")
+
+    def __init__(self, cache_dir=CACHE_DIR, max_mb=DEFAULT_DISK_CACHE_MB, total_mb=DEFAULT_DISK_CACHE_TOTAL_MB):
+        self.cache_dir = cache_dir
+        # max_bytes limita cada entrada; total_bytes, o diretório (0: sem teto)
+        self.max_bytes = max(0, int(max_mb)) * 1024 * 1024
+        self.total_bytes = max(0, int(total_mb)) * 1024 * 1024
+
+    def entry_path(self, gif_path, scaling):
+        # Cada tamanho de exibição tem sua própria entrada
+        name = hashlib.sha1(f"{os.path.abspath(gif_path)}\0{scaling.key()}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name + ".frames")
+
+    @staticmethod
+    def source_digest(gif_path):
+        digest = hashlib.sha256()
+        with open(gif_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.digest()
+
+    @classmethod
+    def source_key(cls, gif_path):
+        stat = os.stat(gif_path)
+        return stat.st_size, stat.st_mtime_ns, cls.source_digest(gif_path)
+
+    @classmethod
+    def is_pack(cls, path):
+        # Um pacote de frames gerado por --render-only --pack: o mesmo formato
+        # do cache, carregado diretamente no lugar do GIF
+        try:
+            with open(path, "rb") as f:
+                return f.read(len(cls.MAGIC)) == cls.MAGIC
+        except OSError:
+            return False
+
+    @classmethod
+    def data_size(cls, header):
+        # Cabeçalho, tabelas e frames; o caminho do GIF de origem vem depois
+        width, height, frame_count = header[1:4]
+        return cls.HEADER.size + 20 * frame_count + width * height * 4 * frame_count
+
+    @classmethod
+    def read_source(cls, path):
+        # Cabeçalho e caminho do GIF de origem de uma entrada, sem mapeá-la;
+        # None se ela for de outro formato
+        with open(path, "rb") as f:
+            data = f.read(cls.HEADER.size)
+            if len(data) < cls.HEADER.size or not data.startswith(cls.MAGIC):
+                return None
+            header = cls.HEADER.unpack(data)
+            f.seek(cls.data_size(header))
+            return header, os.fsdecode(f.read(header[-1]))
+
+    @classmethod
+    def map_entry(cls, path):
+        # Devolve o mapping, os campos do cabeçalho e o mesmo arquivo mapeado
+        # pelo GLib, ou None se o arquivo não estiver completo
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            header = cls.HEADER.unpack_from(mapping, 0)
+            if header[0] != cls.MAGIC or len(mapping) != cls.data_size(header) + header[-1]:
+                mapping.close()
+                return None
+            mapped = GLib.MappedFile.new_from_fd(f.fileno(), False)
+        return mapping, header, mapped
+
+    @classmethod
+    def frames_from(cls, gif_path, mapping, header, mapped=None, min_interval_ms=0):
+        (magic, width, height, frame_count, src_size, src_mtime, digest, loop, plays,
+         logical_w, logical_h, source_w, source_h, _) = header
+        durations = list(struct.unpack_from(f"<{frame_count}I", mapping, cls.HEADER.size))
+        rect_values = struct.unpack_from(f"<{4 * frame_count}I", mapping, cls.HEADER.size + 4 * frame_count)
+        dirty_rects = [tuple(rect_values[i:i + 4]) for i in range(0, len(rect_values), 4)]
+        return CachedFrameSource(gif_path, mapping, (width, height), durations, dirty_rects,
+                                 cls.HEADER.size + 20 * frame_count, digest,
+                                 loop_count=loop if loop >= 0 else None, min_interval_ms=min_interval_ms,
+                                 mapped=mapped, logical_size=(logical_w, logical_h),
+                                 source_size=(source_w, source_h), plays=plays or None)
+
+    @classmethod
+    def open_pack(cls, path, min_interval_ms=0):
+        # Sem GIF de origem para conferir: o pacote vale por si
+        entry = cls.map_entry(path)
+        if entry is None:
+            raise ValueError(f"Incomplete or unsupported frame pack: {path}")
+        logging.debug(f"Loaded {entry[1][3]} frames from frame pack {path}")
+        return cls.frames_from(path, *entry, min_interval_ms=min_interval_ms)
+
+    def load(self, gif_path, scaling, min_interval_ms=0):
+        # Tamanho e mtime bastam para usar o cache de imediato; o hash do
+        # conteúdo é conferido depois por verify(), fora do caminho até o
+        # primeiro frame
+        path = self.entry_path(gif_path, scaling)
+        if self.max_bytes == 0 or not os.path.exists(path):
+            return None
+        try:
+            stat = os.stat(gif_path)
+            entry = self.map_entry(path)
+            if entry is not None and entry[1][4:6] != (stat.st_size, stat.st_mtime_ns):
+                entry[0].close()
+                entry = None
+            if entry is None:
+                logging.debug(f"Disk cache {path} is stale for {gif_path}, discarding")
+                os.remove(path)
+                return None
+            # A data de modificação da entrada marca o último uso, para prune()
+            os.utime(path)
+            logging.debug(f"Loaded {entry[1][3]} frames for {gif_path} from disk cache {path}")
+            return self.frames_from(gif_path, *entry, min_interval_ms=min_interval_ms)
+        except Exception as e:
+            logging.warning(f"Failed to load disk cache {path}: {e}")
+            return None
+
+    def verify(self, gif_path, scaling, digest):
+        # Conteúdo alterado sem mudar tamanho nem mtime: descartar a entrada
+        # para que a próxima execução a reconstrua
+        try:
+            if self.source_digest(gif_path) == digest:
+                return True
+            path = self.entry_path(gif_path, scaling)
+            logging.warning(f"Disk cache {path} does not match the contents of {gif_path}, discarding")
+            os.remove(path)
+        except OSError as e:
+            logging.warning(f"Failed to verify disk cache for {gif_path}: {e}")
+        return False
+
+    def build(self, gif_path, scaling, path=None):
+        # Com path, grava um pacote de frames nesse arquivo, sem o limite do cache
+        pack = path is not None
+        path = path or self.entry_path(gif_path, scaling)
+        tmp_path = None
+        try:
+            src_size, src_mtime, digest = self.source_key(gif_path)
+            with open_decoder(gif_path) as decoder:
+                width, height = scaling.output_size(decoder.size)
+                logical_w, logical_h = scaling.logical_size(decoder.size)
+                loop = decoder.loop_count if decoder.loop_count is not None else -1
+                plays = decoder.plays_for(decoder.loop_count) or 0
+                frame_count = decoder.frame_count
+                source = os.fsencode(os.path.abspath(gif_path))
+                total = self.HEADER.size + 20 * frame_count + width * height * 4 * frame_count + len(source)
+                too_big = total > self.max_bytes or (self.total_bytes and total > self.total_bytes)
+                if too_big and not pack:
+                    logging.debug(f"Skipping disk cache for {gif_path}: {total} bytes exceeds limit")
+                    return False
+
+                # Um temporário próprio por gravação: outra gravação da mesma
+                # entrada (outro processo, outro limite de FPS) não o atropela
+                directory = os.path.dirname(os.path.abspath(path))
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".frames.tmp", dir=directory)
+                durations = []
+                dirty_rects = []
+                differ = FrameDiffer(frame_count, (width, height), scaled=(width, height) != decoder.size)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(self.HEADER.pack(self.MAGIC, width, height, frame_count, src_size, src_mtime, digest, loop,
+                                             plays, logical_w, logical_h, *decoder.size, len(source)))
+                    # Reservar as tabelas; elas são preenchidas após decodificar
+                    f.write(bytes(20 * frame_count))
+                    first = None
+                    for i in range(frame_count):
+                        duration, extent, rgba, _ = decoder.read(i)
+                        durations.append(duration)
+                        rgba = scaling.apply(rgba, (width, height))
+                        dirty_rects.append(differ.feed(i, rgba, extent) or (0, 0, width, height))
+                        if first is None:
+                            first = rgba
+                        f.write(rgba.tobytes())
+                    # A região do frame 0 é relativa ao último frame do loop
+                    dirty_rects[0] = differ.feed(0, first, None) or (0, 0, width, height)
+                    f.write(source)
+                    f.seek(self.HEADER.size)
+                    f.write(struct.pack(f"<{frame_count}I", *durations))
+                    f.write(struct.pack(f"<{4 * frame_count}I", *[v for rect in dirty_rects for v in rect]))
+            # Renomear é atômico: leitores nunca veem um cache pela metade
+            os.replace(tmp_path, path)
+            logging.debug(f"Wrote {'frame pack' if pack else 'disk cache'} {path} for {gif_path} ({total} bytes)")
+        except Exception as e:
+            logging.error(f"Failed to build {'frame pack' if pack else 'disk cache'} for {gif_path}: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        if not pack:
+            self.prune(keep=path)
+        return True
+
+    def prune(self, keep=None):
+        # Depois de gravar uma entrada: descarta as de GIFs que sumiram ou
+        # mudaram e, acima do teto total, as usadas há mais tempo. Outro
+        # processo pode estar fazendo o mesmo, então nada aqui é garantido
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError as e:
+            logging.warning(f"Failed to list disk cache {self.cache_dir}: {e}")
+            return
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            if not name.endswith(".frames"):
+                continue
+            try:
+                stat = os.stat(path)
+                if path != keep and not self.is_current(path):
+                    logging.debug(f"Removing stale disk cache {path}")
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        used = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if not self.total_bytes or used <= self.total_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            used -= size
+            logging.debug(f"Evicted disk cache {path} to stay under {self.total_bytes // (1024 * 1024)} MB")
+
+    @classmethod
+    def is_current(cls, path):
+        # A entrada é do formato atual e o GIF de origem não mudou desde que foi gravada
+        entry = cls.read_source(path)
+        if entry is None:
+            return False
+        header, source = entry
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return False
+        return header[4:6] == (stat.st_size, stat.st_mtime_ns)
+
+class PixbufCache:
+    # Converte cada frame em GdkPixbuf uma única vez e reaproveita nos loops
+    # seguintes; os menos usados são descartados quando o orçamento estoura
+    def __init__(self, frames, cache_mb=DEFAULT_PIXBUF_CACHE_MB):
+        self.frames = frames
+        self.max_bytes = int(max(0, cache_mb) * 1024 * 1024)
+        self.pixbufs = collections.OrderedDict()
+        # Superfícies cairo das telas HiDPI, (escala, superfície) por frame;
+        # contam no mesmo orçamento e saem junto com o pixbuf
+        self.surfaces = {}
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, index, consumer=None):
+        pb = self.pixbufs.get(index)
+        if pb is not None:
+            self.pixbufs.move_to_end(index)
+            self.hits += 1
+            return pb
+
+        get_bytes = getattr(self.frames, "get_frame_bytes", None)
+        if get_bytes is not None:
+            # Frames do cache em disco: o pixbuf usa as páginas do arquivo
+            data = get_bytes(index)
+        else:
+            frame = self.frames.get_frame(index, consumer)
+            if frame is None:
+                # Ainda no pool de processos
+                return None
+            # GLib.Bytes mantém o buffer vivo junto com o pixbuf, sem cópia extra por tick
+            data = GLib.Bytes.new(frame)
+        self.misses += 1
+        width, height = self.frames.size
+        pb = GdkPixbuf.Pixbuf.new_from_bytes(
+            data,
+            GdkPixbuf.Colorspace.RGB,
+            True,
+            8,
+            width,
+            height,
+            width * 4,
+        )
+        self.pixbufs[index] = pb
+        self.bytes_used += data.get_size()
+        self._evict(index)
+        return pb
+
+    def get_surface(self, index, scale, consumer=None):
+        # Normalmente chamado logo depois de get(index), que já contou o acerto
+        pb = self.pixbufs.get(index) or self.get(index, consumer)
+        if pb is None:
+            return None
+        cached = self.surfaces.get(index)
+        if cached is not None and cached[0] == scale:
+            return cached[1]
+        # scale é (x, y): a razão entre os pixels do frame e os lógicos, que
+        # não precisa ser inteira quando o frame foi limitado ao tamanho do GIF
+        surface = Gdk.cairo_surface_create_from_pixbuf(pb, 1, None)
+        surface.set_device_scale(*scale)
+        if cached is None:
+            self.bytes_used += pb.get_byte_length()
+        self.surfaces[index] = (scale, surface)
+        self._evict(index)
+        return surface
+
+    def clear(self):
+        # Os frames pertencem ao FrameStore (ou a quem os criou), que os fecha
+        self.pixbufs.clear()
+        self.surfaces.clear()
+        self.bytes_used = 0
+
+    def _evict(self, keep):
+        while self.bytes_used > self.max_bytes and len(self.pixbufs) > 1:
+            index, pb = self.pixbufs.popitem(last=False)
+            if index == keep:
+                # Nunca descartar o frame que está sendo exibido
+                self.pixbufs[index] = pb
+                continue
+            self.bytes_used -= pb.get_byte_length()
+            if self.surfaces.pop(index, None) is not None:
+                self.bytes_used -= pb.get_byte_length()
+
+def clamp_frame_delay(delay_ms):
+    # Mesma convenção dos navegadores: atrasos ausentes, 0 ou 10 ms viram 100 ms
+    if not delay_ms or delay_ms <= 10:
+        return 100
+    return delay_ms
+
+class Animation:
+    # Estado de reprodução de um desklet: frame atual e prazo do próximo, no
+    # relógio monotônico. Frames atrasados são pulados em vez de enfileirados
+    MAX_LAG = 1.0
+
+    def __init__(self, frames, render, scheduler, speed=1.0, loops=None):
+        self.frames = frames
+        self.render = render
+        self.scheduler = scheduler
+        self.frame_index = 0
+        self.deadline = None
+        self.running = False
+        self.skipped = 0
+        # Atraso, em segundos, do último frame exibido em relação ao seu prazo
+        self.last_lateness = 0.0
+        self.slowdown = 1.0
+        self.speed = speed if speed > 0 else 1.0
+        # None repete para sempre; N para no último frame depois de N voltas
+        self.loops = loops
+        self.loops_done = 0
+        self.finished = False
+        self.paused = False
+        self.remaining = None
+
+    def start(self):
+        if self.running or self.finished:
+            return
+        self.running = True
+        self.render(self.frame_index)
+        if self.frames.frame_count == 1:
+            # Imagem parada (PNG comum, GIF de um frame): nada a agendar
+            return
+        self.deadline = time.monotonic() + self._span(self.frame_index)
+        if not self.paused:
+            self.scheduler.add(self)
+        else:
+            self.remaining = self._span(self.frame_index)
+
+    def stop(self):
+        self.running = False
+        self.remaining = None
+        self.scheduler.remove(self)
+
+    def pause(self):
+        if self.paused:
+            return
+        self.paused = True
+        # Guardar quanto faltava do frame atual para retomar exatamente nele
+        if self.running and self.deadline is not None:
+            self.remaining = max(0.0, self.deadline - time.monotonic())
+            self.scheduler.remove(self)
+
+    def resume(self):
+        if not self.paused:
+            return
+        self.paused = False
+        if self.running and self.remaining is not None:
+            self.deadline = time.monotonic() + self.remaining
+            self.remaining = None
+            self.scheduler.add(self)
+
+    def set_slowdown(self, factor):
+        # Vale a partir do próximo frame
+        self.slowdown = max(1.0, factor)
+
+    def set_speed(self, speed):
+        # Vale a partir do próximo frame
+        self.speed = speed if speed > 0 else 1.0
+
+    def set_loops(self, loops):
+        self.loops = loops
+        if self.finished and (loops is None or self.loops_done < loops):
+            # Limite aumentado depois de parado: continuar de onde parou
+            self.finished = False
+            self.frame_index = 0
+            self.start()
+
+    def _delay(self, index):
+        return clamp_frame_delay(self.frames.get_duration(index)) * self.slowdown / (self.speed * 1000.0)
+
+    def _span(self, index):
+        # Tempo em tela do frame: sua duração mais a dos frames ocultos pelo
+        # limite de FPS que vêm depois dele
+        total = self._delay(index)
+        i = (index + 1) % self.frames.frame_count
+        while i != 0 and not self.frames.is_visible(i):
+            total += self._delay(i)
+            i = (i + 1) % self.frames.frame_count
+        return total
+
+    def _following(self, index):
+        # Próximo frame exibível; o frame 0 sempre é
+        i = (index + 1) % self.frames.frame_count
+        while i != 0 and not self.frames.is_visible(i):
+            i = (i + 1) % self.frames.frame_count
+        return i
+
+    def _finish(self):
+        # Parar no último frame do GIF, mesmo que o limite de FPS o oculte
+        logging.debug(f"Animation finished after {self.loops_done} loop(s)")
+        self.stop()
+        self.finished = True
+        last = self.frames.frame_count - 1
+        if self.frame_index != last:
+            self.frame_index = last
+            self.render(last)
+
+    def advance(self, now):
+        if now - self.deadline > self.MAX_LAG:
+            # Atraso grande (suspensão, loop travado): ressincronizar sem correr atrás
+            log_throttled("animation-resync", logging.DEBUG, f"Animation fell {now - self.deadline:.2f}s behind, resyncing")
+            self.deadline = now
+
+        self.last_lateness = max(0.0, now - self.deadline)
+        index = self.frame_index
+        while True:
+            index = self._following(index)
+            if index == 0:
+                self.loops_done += 1
+                if self.loops is not None and self.loops_done >= self.loops:
+                    self._finish()
+                    return
+            next_deadline = self.deadline + self._span(index)
+            if next_deadline > now:
+                break
+            self.deadline = next_deadline
+            self.skipped += 1
+
+        self.frame_index = index
+        self.deadline = next_deadline
+        self.render(index)
+
+class AnimationScheduler:
+    # Um único timer do GLib para todas as animações do processo, sempre
+    # armado para o prazo mais próximo
+    TOLERANCE = 0.001
+
+    def __init__(self):
+        self.animations = []
+        self.source_id = None
+        self.next_deadline = None
+
+    def add(self, animation):
+        if animation not in self.animations:
+            self.animations.append(animation)
+        self._arm()
+
+    def remove(self, animation):
+        if animation in self.animations:
+            self.animations.remove(animation)
+        self._arm()
+
+    def _arm(self):
+        deadline = min((a.deadline for a in self.animations), default=None)
+        if self.source_id is not None:
+            if deadline == self.next_deadline:
+                return
+            GLib.source_remove(self.source_id)
+            self.source_id = None
+        self.next_deadline = deadline
+        if deadline is None:
+            return
+        timeout_ms = max(0, round((deadline - time.monotonic()) * 1000))
+        self.source_id = GLib.timeout_add(timeout_ms, self._on_timeout)
+
+    def _on_timeout(self):
+        self.source_id = None
+        self.next_deadline = None
+        now = time.monotonic()
+        for animation in list(self.animations):
+            if animation.deadline <= now + self.TOLERANCE:
+                animation.advance(now)
+        self._arm()
+        return False
+
+# Limites, em ms, das faixas do histograma de atraso; a última faixa é aberta
+JITTER_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 250]
+# Frames exibidos com mais atraso que isso contam como atrasados
+LATE_FRAME_MS = 10
+
+class DeskletStats:
+    # Contadores ao vivo de um desklet, consultáveis pelo ControlServer
+    def __init__(self):
+        self.started = time.monotonic()
+        self.frames_rendered = 0
+        self.late_frames = 0
+        self.max_lateness = 0.0
+        self.render_seconds = 0.0
+        self.jitter = [0] * (len(JITTER_BUCKETS_MS) + 1)
+
+    def record(self, lateness, render_seconds):
+        self.frames_rendered += 1
+        self.render_seconds += render_seconds
+        self.max_lateness = max(self.max_lateness, lateness)
+        lateness_ms = lateness * 1000
+        if lateness_ms > LATE_FRAME_MS:
+            self.late_frames += 1
+        for bucket, limit in enumerate(JITTER_BUCKETS_MS):
+            if lateness_ms <= limit:
+                break
+        else:
+            bucket = len(JITTER_BUCKETS_MS)
+        self.jitter[bucket] += 1
+
+    def snapshot(self):
+        labels = [f"<={limit}ms" for limit in JITTER_BUCKETS_MS] + [f">{JITTER_BUCKETS_MS[-1]}ms"]
+        return {
+            "uptime_s": round(time.monotonic() - self.started, 3),
+            "frames_rendered": self.frames_rendered,
+            "late_frames": self.late_frames,
+            "max_lateness_ms": round(self.max_lateness * 1000, 3),
+            "render_ms_mean": round(self.render_seconds * 1000 / max(1, self.frames_rendered), 3),
+            "jitter_histogram": dict(zip(labels, self.jitter)),
+        }
+
+class SystemStateProvider:
+    # Estado do sistema relevante para a reprodução; as implementações
+    # notificam os ouvintes sempre que algum valor muda
+    def __init__(self):
+        self.locked = False
+        self.idle = False
+        self.on_battery = False
+        self.listeners = []
+
+    def connect(self, callback):
+        self.listeners.append(callback)
+
+    def disconnect(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def update(self, **values):
+        changed = False
+        for name, value in values.items():
+            value = bool(value)
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                changed = True
+        if changed:
+            logging.debug(f"System state changed: locked={self.locked}, idle={self.idle}, on_battery={self.on_battery}")
+            for callback in list(self.listeners):
+                callback(self)
+
+class StaticSystemState(SystemStateProvider):
+    # Estado fixo, alterado apenas por update(); usado em testes e quando o D-Bus não está disponível
+    def __init__(self, locked=False, idle=False, on_battery=False):
+        super().__init__()
+        self.locked = locked
+        self.idle = idle
+        self.on_battery = on_battery
+
+class DBusSystemState(SystemStateProvider):
+    # Acompanha logind (sessão bloqueada/ociosa), UPower (bateria) e o protetor
+    # de tela do Cinnamon/GNOME por sinais do D-Bus, sem polling
+    SCREENSAVERS = [
+        ("org.cinnamon.ScreenSaver", "/org/cinnamon/ScreenSaver"),
+        ("org.gnome.ScreenSaver", "/org/gnome/ScreenSaver"),
+    ]
+
+    def __init__(self):
+        super().__init__()
+        self.proxies = []
+
+        # Proxies criados de forma assíncrona: no login o barramento pode
+        # demorar a responder, e o desklet não espera por ele para aparecer
+        self._proxy(Gio.BusType.SYSTEM, "org.freedesktop.login1",
+                    "/org/freedesktop/login1/session/auto", "org.freedesktop.login1.Session", self.on_session_proxy)
+        self._proxy(Gio.BusType.SYSTEM, "org.freedesktop.UPower",
+                    "/org/freedesktop/UPower", "org.freedesktop.UPower", self.on_power_proxy)
+        for name, path in self.SCREENSAVERS:
+            self._proxy(Gio.BusType.SESSION, name, path, name, self.on_screensaver_proxy)
+
+    def _proxy(self, bus_type, name, path, interface, callback):
+        Gio.DBusProxy.new_for_bus(bus_type, Gio.DBusProxyFlags.NONE, None, name, path, interface, None,
+                                  self._on_proxy_ready, (name, callback))
+
+    def _on_proxy_ready(self, source, result, data):
+        name, callback = data
+        try:
+            proxy = Gio.DBusProxy.new_for_bus_finish(result)
+        except GLib.Error as e:
+            logging.debug(f"D-Bus service {name} unavailable: {e}")
+            return
+        self.proxies.append(proxy)
+        callback(proxy)
+
+    def on_session_proxy(self, session):
+        session.connect("g-properties-changed", self.on_session_changed)
+        self.on_session_changed(session, None, None)
+
+    def on_power_proxy(self, upower):
+        upower.connect("g-properties-changed", self.on_power_changed)
+        self.on_power_changed(upower, None, None)
+
+    def on_screensaver_proxy(self, screensaver):
+        if screensaver.get_name_owner() is not None:
+            screensaver.connect("g-signal", self.on_screensaver_signal)
+
+    @staticmethod
+    def _property(proxy, name):
+        value = proxy.get_cached_property(name)
+        return value.unpack() if value is not None else False
+
+    def on_session_changed(self, proxy, changed, invalidated):
+        self.update(locked=self._property(proxy, "LockedHint"), idle=self._property(proxy, "IdleHint"))
+
+    def on_power_changed(self, proxy, changed, invalidated):
+        self.update(on_battery=self._property(proxy, "OnBattery"))
+
+    def on_screensaver_signal(self, proxy, sender, signal_name, parameters):
+        if signal_name == "ActiveChanged":
+            self.update(locked=parameters.unpack()[0])
+
+_system_state = None
+
+def get_system_state():
+    # Um único provedor por processo, criado na primeira vez que é pedido
+    global _system_state
+    if _system_state is None:
+        try:
+            _system_state = DBusSystemState()
+        except Exception as e:
+            logging.warning(f"Falling back to static system state: {e}")
+            _system_state = StaticSystemState()
+    return _system_state
+
+# Geometria em pixels lógicos e fator de escala (HiDPI) de um monitor
+MonitorInfo = collections.namedtuple("MonitorInfo", ["x", "y", "width", "height", "scale"])
+
+class MonitorLayout:
+    # Geometria e escala de cada monitor, guardadas em cache e atualizadas
+    # pelos sinais do GDK. Conectar ou desconectar monitores (docking) gera
+    # uma rajada de sinais: uma única atualização por rajada avisa os
+    # ouvintes com os índices que mudaram
+    def __init__(self):
+        self.monitors = []
+        self.primary = 0
+        self.listeners = []
+        self.watched = {}
+        self.refresh_id = None
+        self.display = Gdk.Display.get_default()
+        if self.display is not None:
+            self.display.connect("monitor-added", self.on_monitor_added)
+            self.display.connect("monitor-removed", self.on_monitor_removed)
+        self.refresh()
+
+    def connect(self, callback):
+        self.listeners.append(callback)
+
+    def disconnect(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def resolve(self, index):
+        # Monitor desconectado (ou índice inválido): usar o principal até ele voltar
+        if 0 <= index < len(self.monitors):
+            return index
+        if self.monitors:
+            log_throttled(f"monitor-missing-{index}", logging.WARNING,
+                          f"Monitor {index} is not connected, using monitor {self.primary}")
+        return self.primary
+
+    def geometry(self, index):
+        index = self.resolve(index)
+        return self.monitors[index] if index < len(self.monitors) else MonitorInfo(0, 0, 0, 0, 1)
+
+    def scale_factor(self, index):
+        return self.geometry(index).scale
+
+    def on_monitor_added(self, display, monitor):
+        self.schedule_refresh()
+
+    def on_monitor_removed(self, display, monitor):
+        for handler in self.watched.pop(monitor, []):
+            monitor.disconnect(handler)
+        self.schedule_refresh()
+
+    def schedule_refresh(self, *args):
+        if self.refresh_id is None:
+            self.refresh_id = GLib.idle_add(self.refresh)
+
+    def refresh(self):
+        self.refresh_id = None
+        monitors = []
+        primary = 0
+        if self.display is not None:
+            primary_monitor = self.display.get_primary_monitor()
+            for i in range(self.display.get_n_monitors()):
+                monitor = self.display.get_monitor(i)
+                if monitor not in self.watched:
+                    self.watched[monitor] = [monitor.connect("notify::geometry", self.schedule_refresh),
+                                             monitor.connect("notify::scale-factor", self.schedule_refresh)]
+                if monitor == primary_monitor:
+                    primary = i
+                rect = monitor.get_geometry()
+                monitors.append(MonitorInfo(rect.x, rect.y, rect.width, rect.height, max(1, monitor.get_scale_factor())))
+        old = self.monitors
+        changed = {i for i in range(max(len(old), len(monitors)))
+                   if (old[i] if i < len(old) else None) != (monitors[i] if i < len(monitors) else None)}
+        self.monitors = monitors
+        self.primary = primary
+        if changed and old:
+            logging.info(f"Monitor layout changed: {len(monitors)} monitor(s), changed {sorted(changed)}: {monitors}")
+            for callback in list(self.listeners):
+                callback(changed)
+        return False
+
+_monitor_layout = None
+
+def get_monitor_layout():
+    # Um único cache de monitores por processo, criado na primeira vez que é pedido
+    global _monitor_layout
+    if _monitor_layout is None:
+        _monitor_layout = MonitorLayout()
+    return _monitor_layout
+
+BATTERY_MODES = ["normal", "slow", "pause"]
+
+class PlaybackPolicy:
+    # Quando pausar ou desacelerar a animação
+    def __init__(self, pause_when_hidden=True, pause_when_locked=True, pause_when_idle=False,
+                 battery_mode="slow", battery_slowdown=2.0):
+        self.pause_when_hidden = pause_when_hidden
+        self.pause_when_locked = pause_when_locked
+        self.pause_when_idle = pause_when_idle
+        self.battery_mode = battery_mode if battery_mode in BATTERY_MODES else "slow"
+        self.battery_slowdown = battery_slowdown
+
+    @classmethod
+    def from_settings(cls, settings):
+        try:
+            return cls(
+                pause_when_hidden=settings.get("pause_when_hidden", "True").lower() == "true",
+                pause_when_locked=settings.get("pause_when_locked", "True").lower() == "true",
+                pause_when_idle=settings.get("pause_when_idle", "False").lower() == "true",
+                battery_mode=settings.get("battery_mode", "slow"),
+                battery_slowdown=float(settings.get("battery_slowdown", "2.0")),
+            )
+        except ValueError as e:
+            logging.warning(f"Invalid playback policy settings, using defaults: {e}")
+            return cls()
+
+    def decide(self, hidden, state):
+        # Retorna (pausar, fator de desaceleração)
+        paused = ((hidden and self.pause_when_hidden) or
+                  (state.locked and self.pause_when_locked) or
+                  (state.idle and self.pause_when_idle) or
+                  (state.on_battery and self.battery_mode == "pause"))
+        slowdown = self.battery_slowdown if state.on_battery and self.battery_mode == "slow" else 1.0
+        return paused, slowdown
+
+def instance_section(name):
+    # A instância padrão continua usando a seção [Desklet] das versões anteriores
+    return "Desklet" if name == DEFAULT_INSTANCE else f"Desklet:{name}"
+
+def instance_names(config):
+    names = []
+    for section in config.sections():
+        if section == "Desklet":
+            names.append(DEFAULT_INSTANCE)
+        elif section.startswith("Desklet:"):
+            names.append(section[len("Desklet:"):])
+    return names
+
+def valid_instance_name(name):
+    # O nome vira nome de arquivo de lock
+    return bool(name) and all(c.isalnum() or c in "-_" for c in name)
+
+def desklet_options(settings):
+    # Opções de GifDesklet que vêm direto de uma seção do INI
+    return {
+        "frame_memory_mb": int(settings.get("frame_memory_mb", str(DEFAULT_FRAME_MEMORY_MB))),
+        "palette_memory_mb": int(settings.get("palette_memory_mb", str(DEFAULT_PALETTE_MEMORY_MB))),
+        "pixbuf_cache_mb": int(settings.get("pixbuf_cache_mb", str(DEFAULT_PIXBUF_CACHE_MB))),
+        "disk_cache_mb": int(settings.get("disk_cache_mb", str(DEFAULT_DISK_CACHE_MB))),
+        "render_mode": settings.get("render_mode", "full"),
+        "playback_policy": PlaybackPolicy.from_settings(settings),
+        "scale": float(settings.get("scale", "1.0")),
+        "target_width": int(settings.get("width", "0")),
+        "target_height": int(settings.get("height", "0")),
+        "resample": settings.get("resample", "lanczos"),
+        "watch_file": settings.get("watch_file", "False").lower() == "true",
+        "speed": float(settings.get("speed", "1.0")),
+        "max_fps": float(settings.get("max_fps", "0")),
+        "loops": settings.get("loops", "forever").strip().lower(),
+    }
+
+def min_frame_interval_ms(max_fps, speed):
+    # Intervalo mínimo entre frames exibidos, em tempo do GIF (antes da
+    # velocidade), para um limite de FPS; 0 sem limite
+    if max_fps <= 0:
+        return 0
+    return int(round(1000.0 / max_fps * (speed if speed > 0 else 1.0)))
+
+def placement_options(settings):
+    # Arquivo e posição do desklet, da mesma seção do INI
+    position = settings.get("position", "bottom-right")
+    return {
+        "gif_path": settings.get("gif_path", ""),
+        "monitor_index": int(settings.get("monitor", "0")),
+        "position": position,
+        "margin": int(settings.get("margin", "20")),
+        # GifDesklet limita a posição custom ao monitor usando o tamanho já escalado
+        "custom_x": settings.get("custom_x") if position == "custom" else None,
+        "custom_y": settings.get("custom_y") if position == "custom" else None,
+    }
+
+class InstanceRegistry:
+    # Cada instância em execução é um socket Unix em ~/.gif_desklet/instances,
+    # servido pelo processo que a hospeda. Conseguir conectar é a prova de que
+    # ela está viva: não há PID que possa ser reaproveitado nem lock a limpar
+    def __init__(self, directory=INSTANCES_DIR):
+        self.directory = directory
+
+    def socket_path(self, name):
+        return os.path.join(self.directory, f"{name}.sock")
+
+    def is_running(self, name):
+        try:
+            self.request(name, "ping")
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def running_instances(self):
+        if not os.path.isdir(self.directory):
+            return []
+        names = [entry[:-len(".sock")] for entry in os.listdir(self.directory) if entry.endswith(".sock")]
+        return [name for name in sorted(names) if self.is_running(name)]
+
+    def request(self, name, command, timeout=2.0):
+        path = self.socket_path(name)
+        try:
+            return control_request(path, command, timeout)
+        except ConnectionRefusedError:
+            # Socket de um processo que morreu sem removê-lo
+            logging.debug(f"Removing stale control socket {path}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            raise
+
+def control_request(path, command, timeout=2.0):
+    # Lado do cliente: envia um comando de uma linha e devolve a resposta,
+    # uma linha de JSON, já decodificada
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(command.encode() + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+DECODE_MODES = ["thread", "process", "shared"]
+DEFAULT_DECODE_WORKERS = 2
+# Segundos esperando um worker ler os cabeçalhos de um GIF
+PROBE_TIMEOUT = 10
+
+class DecodePool:
+    # Executor compartilhado que decodifica os GIFs fora da thread do GTK.
+    # "process" isola a decodificação em processos (iniciados com spawn, já que
+    # fork de um processo GTK não é seguro); "shared" usa os mesmos processos,
+    # mas os frames voltam por memória compartilhada em vez do pipe
+    def __init__(self, mode="thread", workers=DEFAULT_DECODE_WORKERS):
+        self.mode = mode if mode in DECODE_MODES else "thread"
+        self.workers = max(1, workers)
+        self.lock = threading.Lock()
+        # Decodificação fora do processo do GTK
+        self.isolated = self.mode in ("process", "shared")
+        # Nos modos de processo cada worker é um executor de um processo só:
+        # as tarefas de uma mesma afinidade (um GIF) vão sempre para ele, onde
+        # o decodificador e o último frame composto continuam abertos. As
+        # threads já compartilham um decodificador por arquivo
+        self.executors = [self._new_executor() for _ in range(self.workers if self.isolated else 1)]
+        self.affinities = {}
+        self.next_lane = 0
+        logging.debug(f"Decode pool started: mode={self.mode}, workers={self.workers}")
+
+    def _new_executor(self):
+        if self.isolated:
+            return concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        return concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="decode")
+
+    def _lane(self, affinity):
+        # Uma afinidade nova vai para o worker com menos afinidades; sem
+        # afinidade, os workers se revezam
+        if affinity is None:
+            lane = self.next_lane
+            self.next_lane = (lane + 1) % len(self.executors)
+            return lane
+        lane = self.affinities.get(affinity)
+        if lane is None:
+            counts = [0] * len(self.executors)
+            for used in self.affinities.values():
+                counts[used] += 1
+            lane = self.affinities[affinity] = counts.index(min(counts))
+        return lane
+
+    def submit(self, fn, *args, affinity=None):
+        with self.lock:
+            lane = self._lane(affinity)
+            try:
+                return self.executors[lane].submit(fn, *args)
+            except concurrent.futures.BrokenExecutor:
+                # O worker morreu e levou o executor junto: recriar o processo
+                logging.warning(f"Decode pool ({self.mode}) worker {lane} is broken, restarting it")
+                self.executors[lane].shutdown(wait=False)
+                self.executors[lane] = self._new_executor()
+                return self.executors[lane].submit(fn, *args)
+
+    def forget(self, affinity):
+        with self.lock:
+            self.affinities.pop(affinity, None)
+
+    def shutdown(self):
+        with self.lock:
+            for executor in self.executors:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+def general_settings():
+    # Opções do processo inteiro, na seção [General] do INI
+    config = configparser.ConfigParser()
+    if os.path.exists(CONFIG_FILE):
+        config.read(CONFIG_FILE)
+    return dict(config["General"]) if "General" in config else {}
+
+def int_setting(settings, key, default):
+    try:
+        return int(settings.get(key, str(default)))
+    except ValueError:
+        logging.warning(f"Invalid value for {key}: {settings.get(key)}, using {default}")
+        return default
+
+def write_config_atomic(config, path=CONFIG_FILE):
+    # Grava em um arquivo temporário no mesmo diretório e troca com rename:
+    # um processo morto no meio da escrita nunca deixa o INI truncado
+    directory = os.path.dirname(path)
+    pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".gif_desklet.", suffix=".ini.tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            config.write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class ConfigWriter:
+    # Atualizações de chaves do INI vindas dos desklets (ex.: posição após
+    # arrastar). Agrupa as alterações por DELAY_MS e grava numa thread
+    # própria, sem bloquear o loop do GTK
+    DELAY_MS = 500
+
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self.pending = {}
+        self.source_id = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="config")
+
+    def update(self, section, values):
+        self.pending.setdefault(section, {}).update(values)
+        if self.source_id is not None:
+            GLib.source_remove(self.source_id)
+        self.source_id = GLib.timeout_add(self.DELAY_MS, self._flush)
+
+    def _flush(self):
+        self.source_id = None
+        pending, self.pending = self.pending, {}
+        if pending:
+            self.executor.submit(self._write, pending)
+        return False
+
+    def _write(self, pending):
+        # Relê o INI para não sobrescrever o que outro processo gravou
+        try:
+            config = configparser.ConfigParser()
+            if os.path.exists(self.path):
+                config.read(self.path)
+            changed = False
+            for section, values in pending.items():
+                # Seções removidas nesse meio tempo continuam removidas
+                if section in config:
+                    config[section].update(values)
+                    changed = True
+            if changed:
+                write_config_atomic(config, self.path)
+                logging.debug(f"Saved {pending} to {self.path}")
+        except Exception as e:
+            logging.error(f"Failed to save {pending} to {self.path}: {e}")
+
+    def flush(self):
+        # Grava o que estiver pendente e espera a escrita terminar
+        if self.source_id is not None:
+            GLib.source_remove(self.source_id)
+        self._flush()
+        self.executor.shutdown(wait=True)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="config")
+
+_config_writer = None
+
+def get_config_writer():
+    global _config_writer
+    if _config_writer is None:
+        _config_writer = ConfigWriter()
+    return _config_writer
+
+class MemoryPlan:
+    # Como os frames de um GIF cabem no orçamento: a estratégia escolhida, o
+    # tamanho e o limite de FPS efetivos e os tetos de cada armazenamento, em bytes
+    def __init__(self, strategy, scaling, min_interval_ms, decoded_bytes, frame_bytes, pixbuf_bytes, palette_bytes):
+        self.strategy = strategy
+        self.scaling = scaling
+        self.min_interval_ms = min_interval_ms
+        self.decoded_bytes = decoded_bytes
+        self.frame_bytes = frame_bytes
+        self.pixbuf_bytes = pixbuf_bytes
+        self.palette_bytes = palette_bytes
+
+    @property
+    def reserved_bytes(self):
+        return self.frame_bytes + self.pixbuf_bytes + self.palette_bytes
+
+    def describe(self):
+        mb = 1024 * 1024
+        return {
+            "strategy": self.strategy,
+            "decoded_mb": round(self.decoded_bytes / mb, 1),
+            "reserved_mb": round(self.reserved_bytes / mb, 1),
+            "frame_memory_mb": round(self.frame_bytes / mb, 1),
+            "pixbuf_cache_mb": round(self.pixbuf_bytes / mb, 1),
+            "palette_memory_mb": round(self.palette_bytes / mb, 1),
+            "scaling": self.scaling.key(),
+            "min_interval_ms": self.min_interval_ms,
+        }
+
+class MemoryBudget:
+    # Orçamento global de memória de frames, dividido entre as entradas do
+    # FrameStore. Cada GIF novo recebe um plano calculado pelo tamanho
+    # decodificado (largura x altura x 4 x frames, dos cabeçalhos), na ordem
+    # de preferência: todos os frames em cache, janela de streaming, janela
+    # mínima com limite de FPS e, por último, frames reduzidos
+    MIN_WINDOW_FRAMES = 2
+    # Limite de FPS quando só cabe um frame à frente
+    SKIP_INTERVAL_MS = 100
+    # Nenhum desklet fica com menos que isto, mesmo com o orçamento esgotado
+    MIN_SHARE = 8 * 1024 * 1024
+
+    def __init__(self, budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+        # 0 desativa o orçamento: valem só os tetos de cada desklet
+        self.max_bytes = max(0, int(budget_mb)) * 1024 * 1024
+        self.reserved = {}
+
+    def available(self):
+        return self.max_bytes - sum(self.reserved.values())
+
+    def plan(self, source_size, frame_count, scaling, min_interval_ms, frame_memory_mb, pixbuf_cache_mb,
+             palette_memory_mb, palette_frames=False, mapped=False):
+        # mapped: frames servidos do cache em disco, que não ocupam a janela nem a paleta
+        mb = 1024 * 1024
+        size = scaling.output_size(source_size)
+        one = size[0] * size[1] * 4
+        decoded = one * frame_count
+        ring = 0 if mapped else min(int(frame_memory_mb * mb), DEFAULT_FRAMES_AHEAD * one, decoded)
+        pixbufs = min(int(pixbuf_cache_mb * mb), decoded)
+        palette = 0
+        if palette_frames and not mapped and size == source_size:
+            palette = min(int(palette_memory_mb * mb), source_size[0] * source_size[1] * frame_count)
+        strategy = "full" if pixbufs >= decoded else "window"
+        if not self.max_bytes or ring + pixbufs + palette <= self.available():
+            return MemoryPlan(strategy, scaling, min_interval_ms, decoded, ring, pixbufs, palette)
+
+        # Fora do orçamento: a paleta sai primeiro e o resto é dividido entre
+        # a janela de frames e o cache de pixbufs
+        share = max(self.available(), self.MIN_SHARE)
+        per_store = share // (1 if mapped else 2)
+        if per_store >= self.MIN_WINDOW_FRAMES * one:
+            return MemoryPlan("window", scaling, min_interval_ms, decoded,
+                              min(ring, per_store), min(pixbufs, per_store), 0)
+        if per_store >= one:
+            # Só um frame à frente: limitar o FPS para a decodificação sob demanda acompanhar
+            return MemoryPlan("skip", scaling, max(min_interval_ms, self.SKIP_INTERVAL_MS), decoded,
+                              0 if mapped else one, one, 0)
+
+        # Nem um frame cabe: reduzir os frames até caber a janela mínima
+        ratio = (share / 2 / (self.MIN_WINDOW_FRAMES * one)) ** 0.5
+        width, height = scaling.logical_size(source_size)
+        reduced = FrameScaling(width=max(1, int(width * ratio)), height=max(1, int(height * ratio)),
+                               resample=scaling.resample, device_scale=scaling.device_scale)
+        size = reduced.output_size(source_size)
+        one = size[0] * size[1] * 4
+        window = self.MIN_WINDOW_FRAMES * one
+        return MemoryPlan("downscale", reduced, min_interval_ms, one * frame_count, window, window, 0)
+
+    def reserve(self, key, plan):
+        self.reserved[key] = plan.reserved_bytes
+
+    def release(self, key):
+        self.reserved.pop(key, None)
+
+class FrameStore:
+    # Frames e pixbufs compartilhados entre os desklets do processo: o mesmo
+    # GIF exibido por vários desklets é decodificado uma única vez
+    def __init__(self, pool=None, budget=None, disk_cache_total_mb=DEFAULT_DISK_CACHE_TOTAL_MB):
+        self.entries = {}
+        self.pool = pool
+        self.budget = budget or MemoryBudget(0)
+        self.disk_cache_total_mb = disk_cache_total_mb
+        # Entradas do cache em disco sendo gravadas agora
+        self.building = set()
+        # Cabeçalhos já lidos por prepare(), por versão do arquivo
+        self.infos = {}
+
+    @staticmethod
+    def source_key(gif_path):
+        stat = os.stat(gif_path)
+        return os.path.realpath(gif_path), stat.st_size, stat.st_mtime_ns
+
+    @classmethod
+    def key(cls, gif_path, scaling, min_interval_ms=0):
+        # Desklets com limites de FPS diferentes exibem conjuntos diferentes de frames
+        return cls.source_key(gif_path) + (scaling.key(), min_interval_ms)
+
+    def acquire(self, gif_path, frame_memory_mb=DEFAULT_FRAME_MEMORY_MB, pixbuf_cache_mb=DEFAULT_PIXBUF_CACHE_MB,
+                disk_cache_mb=DEFAULT_DISK_CACHE_MB, scaling=None, palette_memory_mb=DEFAULT_PALETTE_MEMORY_MB,
+                min_interval_ms=0):
+        scaling = scaling or FrameScaling()
+        key = self.key(gif_path, scaling, min_interval_ms)
+        entry = self.entries.get(key)
+        if entry is None:
+            caps = (frame_memory_mb, pixbuf_cache_mb, palette_memory_mb)
+            # Reaproveitar frames já convertidos em execuções anteriores; o
+            # cache em disco guarda todos os frames e serve a qualquer limite de FPS
+            disk_cache = DiskFrameCache(max_mb=disk_cache_mb, total_mb=self.disk_cache_total_mb)
+            # Pacotes de frames têm tamanho fixo e não passam pelo decodificador
+            pack = DiskFrameCache.is_pack(gif_path)
+            if pack:
+                frames = DiskFrameCache.open_pack(gif_path, min_interval_ms)
+            else:
+                frames = disk_cache.load(gif_path, scaling, min_interval_ms)
+            if frames is not None:
+                plan = self.budget.plan(frames.size, frames.frame_count, FrameScaling(), min_interval_ms, *caps,
+                                        mapped=True)
+                if plan.strategy == "downscale" and not pack:
+                    frames.close()
+                    frames = None
+                else:
+                    plan.scaling = scaling
+                    frames.visibility = FrameVisibility(frames.frame_count, plan.min_interval_ms)
+                    frames.visibility.update(frames.durations)
+            if frames is None:
+                info = self.infos.get(self.source_key(gif_path)) or self.probe(gif_path)
+                plan = self.budget.plan(info.size, info.frame_count, scaling, min_interval_ms, *caps,
+                                        info.palette_frames)
+                if plan.scaling is not scaling:
+                    frames = disk_cache.load(gif_path, plan.scaling, plan.min_interval_ms)
+            if frames is not None and self.pool is not None and not pack:
+                self.pool.submit(disk_cache.verify, gif_path, plan.scaling, frames.digest)
+            if frames is None:
+                isolated = self.pool is not None and self.pool.isolated
+                frames = FrameSource(gif_path, frame_memory_mb=plan.frame_bytes / (1024 * 1024),
+                                     scaling=plan.scaling, palette_memory_mb=plan.palette_bytes / (1024 * 1024),
+                                     min_interval_ms=plan.min_interval_ms, info=info if isolated else None)
+                if self.pool is not None:
+                    frames.preload(self.pool)
+                if disk_cache.max_bytes > 0:
+                    # Gravar o cache em disco só depois da primeira passada, sem disputar o pool com ela
+                    frames.add_complete_listener(lambda: self.build_disk_cache(disk_cache, gif_path, plan.scaling))
+                    if self.pool is None:
+                        self.build_disk_cache(disk_cache, gif_path, plan.scaling)
+            self.budget.reserve(key, plan)
+            summary = plan.describe()
+            budget = f"{self.budget.max_bytes // (1024 * 1024)} MB budget" if self.budget.max_bytes else "no budget"
+            level = logging.WARNING if plan.strategy in ("skip", "downscale") else logging.INFO
+            logging.log(level, f"Memory plan for {gif_path}: {plan.strategy}, {summary['decoded_mb']} MB decoded, "
+                               f"{summary['reserved_mb']} MB reserved ({budget})")
+            entry = self.entries[key] = [frames, PixbufCache(frames, plan.pixbuf_bytes / (1024 * 1024)), 0, plan]
+        else:
+            logging.debug(f"Sharing decoded frames of {gif_path} with {entry[2]} other desklet(s)")
+        entry[2] += 1
+        return key, entry[0], entry[1]
+
+    def rescale(self, base_key, size, resample="lanczos", pixbuf_cache_mb=DEFAULT_PIXBUF_CACHE_MB):
+        # Os frames de uma entrada existente em outro tamanho, sem redecodificar.
+        # A entrada nova segura uma referência à base enquanto existir
+        base = self.entries[base_key]
+        if isinstance(base[0], RescaledFrameSource):
+            base_key = base[0].base_key
+            base = self.entries[base_key]
+        if tuple(size) == tuple(base[0].size):
+            base[2] += 1
+            return base_key, base[0], base[1]
+        key = base_key + (("rescaled",) + tuple(size),)
+        entry = self.entries.get(key)
+        if entry is None:
+            frames = RescaledFrameSource(base[0], base_key, tuple(size), resample)
+            plan = self.budget.plan(frames.size, frames.frame_count, FrameScaling(), base[3].min_interval_ms,
+                                    0, pixbuf_cache_mb, 0, mapped=True)
+            base[2] += 1
+            self.budget.reserve(key, plan)
+            logging.info(f"Rescaling frames of {frames.gif_path} from {base[0].size} to {frames.size} "
+                         f"without decoding ({plan.strategy})")
+            entry = self.entries[key] = [frames, PixbufCache(frames, plan.pixbuf_bytes / (1024 * 1024)), 0, plan]
+        entry[2] += 1
+        return key, entry[0], entry[1]
+
+    def probe(self, gif_path):
+        # Nos modos de processo até os cabeçalhos são lidos num worker: nenhum
+        # decodificador é aberto no processo do GTK. Os desklets chamam
+        # prepare() antes, e aqui só chega quem não chamou (ex.: --benchmark)
+        if self.pool is not None and self.pool.isolated:
+            return self.pool.submit(probe_animation, gif_path, affinity=gif_path).result(timeout=PROBE_TIMEOUT)
+        return probe_animation(gif_path)
+
+    def prepare(self, gif_path, callback, attempt=1):
+        # Deixa acquire() pronto para rodar sem esperar pelo pool: nos modos de
+        # processo os cabeçalhos são lidos num worker sem bloquear o GTK.
+        # callback(mensagem de erro ou None) roda no loop do GTK; no modo
+        # thread, em pacotes e em arquivos já lidos, roda aqui mesmo
+        try:
+            source = self.source_key(gif_path)
+        except OSError as e:
+            callback(str(e))
+            return
+        if self.pool is None or not self.pool.isolated or source in self.infos or DiskFrameCache.is_pack(gif_path):
+            callback(None)
+            return
+        # No worker que vai decodificar os blocos, onde o decodificador fica aberto
+        future = self.pool.submit(probe_animation, gif_path, affinity=gif_path)
+        future.add_done_callback(
+            lambda future: GLib.idle_add(self._probed, future, gif_path, source, callback, attempt))
+
+    def _probed(self, future, gif_path, source, callback, attempt):
+        try:
+            info = future.result()
+        except concurrent.futures.BrokenExecutor as e:
+            # Como nos blocos de frames: o pool é recriado e a leitura
+            # repetida, até MAX_CRASHES vezes
+            logging.error(f"Decode worker crashed probing {gif_path} ({attempt}/{FrameSource.MAX_CRASHES}): {e}")
+            if attempt <= FrameSource.MAX_CRASHES:
+                self.prepare(gif_path, callback, attempt + 1)
+                return False
+            callback(f"decode worker crashed {attempt} times")
+            return False
+        except Exception as e:
+            logging.error(f"Failed to read the headers of {gif_path}: {e}")
+            callback(str(e) or type(e).__name__)
+            return False
+        # Versões antigas do mesmo arquivo não servem mais
+        for old in [key for key in self.infos if key[0] == source[0]]:
+            del self.infos[old]
+        self.infos[source] = info
+        callback(None)
+        return False
+
+    def build_disk_cache(self, disk_cache, gif_path, scaling):
+        # O limite de FPS não muda o que vai para o disco: desklets que só
+        # diferem nele pedem a mesma entrada, que é gravada uma vez
+        path = disk_cache.entry_path(gif_path, scaling)
+        if path in self.building:
+            logging.debug(f"Disk cache {path} is already being written")
+            return
+        self.building.add(path)
+        if self.pool is not None:
+            future = self.pool.submit(disk_cache.build, gif_path, scaling)
+            future.add_done_callback(lambda future: self.building.discard(path))
+        else:
+            def build():
+                try:
+                    disk_cache.build(gif_path, scaling)
+                finally:
+                    self.building.discard(path)
+            threading.Thread(target=build, daemon=True).start()
+
+    def release(self, key, consumer=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry[0].forget(consumer)
+        entry[2] -= 1
+        if entry[2] <= 0:
+            frames, pixbufs, _, _ = self.entries.pop(key)
+            self.budget.release(key)
+            pixbufs.clear()
+            frames.close()
+            if isinstance(frames, RescaledFrameSource):
+                self.release(frames.base_key)
+            elif (isinstance(frames, FrameSource) and self.pool is not None and self.pool.isolated
+                    and not any(other[0] == key[0] for other in self.entries)):
+                # Nenhum frame desse arquivo sobrou: fechar o decodificador que
+                # ficou aberto no worker (leitura dos cabeçalhos, blocos sob demanda)
+                self.pool.submit(release_animation, frames.gif_path, affinity=frames.gif_path)
+                self.pool.forget(frames.gif_path)
+
+    def plan(self, key):
+        entry = self.entries.get(key)
+        return entry[3] if entry is not None else None
 
-# Configurar logging para depuração
-logging.basicConfig(filename=os.path.expanduser("~/.gif_desklet/autostart.log"),
-                    level=logging.DEBUG,
-                    format="%(asctime)s - %(levelname)s - %(message)s")
+class ControlServer:
+    # Serve o socket de controle de cada instância hospedada no processo.
+    # Cada comando é uma linha de texto e a resposta, uma linha de JSON,
+    # enviada só depois que o comando foi executado. Tudo roda no loop do
+    # GTK, com leitura assíncrona para que um cliente lento não trave a animação
+    def __init__(self, host):
+        self.host = host
+        self.services = {}
+        self.commands = {
+            "ping": self.cmd_ping,
+            "status": self.cmd_status,
+            "stats": self.cmd_stats,
+            "start": self.cmd_start,
+            "stop": self.cmd_stop,
+            "reload": self.cmd_reload,
+        }
+
+    def listen(self, name):
+        registry = self.host.registry
+        path = registry.socket_path(name)
+        if registry.is_running(name):
+            raise RuntimeError(f"Instance {name} is already running")
+        pathlib.Path(registry.directory).mkdir(parents=True, exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        service = Gio.SocketService()
+        service.add_address(Gio.UnixSocketAddress.new(path), Gio.SocketType.STREAM,
+                            Gio.SocketProtocol.DEFAULT, None)
+        service.connect("incoming", self.on_incoming, name)
+        service.start()
+        self.services[name] = service
+        logging.debug(f"Control socket for instance {name} listening on {path}")
+
+    def unlisten(self, name):
+        service = self.services.pop(name, None)
+        if service is None:
+            return
+        service.stop()
+        service.close()
+        path = self.host.registry.socket_path(name)
+        if os.path.exists(path):
+            os.remove(path)
+        logging.debug(f"Control socket for instance {name} closed")
+
+    def on_incoming(self, service, connection, source, name):
+        stream = Gio.DataInputStream.new(connection.get_input_stream())
+        stream.read_line_async(GLib.PRIORITY_DEFAULT, None, self.on_request, (connection, name))
+        return True
+
+    def on_request(self, stream, result, data):
+        connection, name = data
+        try:
+            line, _ = stream.read_line_finish_utf8(result)
+            command, _, argument = (line or "").strip().partition(" ")
+            handler = self.commands.get(command)
+            if handler is None:
+                reply = {"error": f"unknown command: {command}"}
+            else:
+                try:
+                    reply = handler(name, argument.strip())
+                except Exception as e:
+                    logging.error(f"Control command {command!r} for instance {name} failed: {e}")
+                    reply = {"error": str(e)}
+            connection.get_output_stream().write_all((json.dumps(reply) + "\n").encode(), None)
+        except Exception as e:
+            log_throttled("control-request", logging.ERROR, f"Control request failed: {e}")
+        finally:
+            connection.close(None)
+
+    def cmd_ping(self, name, argument):
+        return {"ok": True}
+
+    def cmd_status(self, name, argument):
+        desklet = self.host.desklets.get(name)
+        return {
+            "pid": os.getpid(),
+            "instance": name,
+            "gif_path": desklet.frames.gif_path if desklet is not None else None,
+            "paused": desklet.animation.paused if desklet is not None else None,
+            "hosted": sorted(self.host.desklets),
+        }
+
+    def cmd_stats(self, name, argument):
+        desklet = self.host.desklets.get(name)
+        if desklet is None:
+            return {"error": f"instance not running: {name}"}
+        return {"pid": os.getpid(), "instances": {name: desklet.stats_snapshot()}}
+
+    def cmd_start(self, name, argument):
+        # Inicia outra instância neste mesmo processo
+        self.host.start(argument or name)
+        return {"ok": True}
+
+    def cmd_stop(self, name, argument):
+        self.host.stop(argument or name)
+        return {"ok": True}
+
+    def cmd_reload(self, name, argument):
+        self.host.reload(argument or name)
+        return {"ok": True}
+
+    def close(self):
+        for name in list(self.services):
+            self.unlisten(name)
+
+def instance_command(command, name=None, output=None):
+    # Linha de comando: envia command às instâncias em execução (ou só a
+    # name) e imprime as respostas como JSON
+    registry = InstanceRegistry()
+    names = [name] if name else registry.running_instances()
+    report = {}
+    for instance in names:
+        try:
+            report[instance] = registry.request(instance, command)
+        except (OSError, ValueError) as e:
+            report[instance] = {"error": f"not running ({e})"}
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+def start_instance(name):
+    # Linha de comando: pede a um processo que já hospeda desklets para
+    # iniciar a instância; sem nenhum, este processo passa a hospedá-la
+    registry = InstanceRegistry()
+    if registry.is_running(name):
+        print(json.dumps({name: {"error": "already running"}}, indent=2))
+        return
+    for running in registry.running_instances():
+        try:
+            reply = registry.request(running, f"start {name}")
+        except (OSError, ValueError):
+            continue
+        print(json.dumps({name: reply}, indent=2))
+        return
+    host = get_host()
+    host.quit_when_empty = True
+    try:
+        host.start(name)
+    except Exception as e:
+        print(json.dumps({name: {"error": str(e)}}, indent=2))
+        host.shutdown()
+        return
+    print(json.dumps({name: {"ok": True, "pid": os.getpid()}}, indent=2))
+    sys.stdout.flush()
+    Gtk.main()
+    host.shutdown()
+
+class DeskletHost:
+    # Tudo que os desklets de um processo compartilham: o agendador, os
+    # frames decodificados e os sockets de controle das instâncias
+    def __init__(self, settings=None):
+        settings = settings or {}
+        self.scheduler = AnimationScheduler()
+        workers = int_setting(settings, "decode_workers", DEFAULT_DECODE_WORKERS)
+        self.pool = DecodePool(settings.get("decode_mode", "thread"), workers)
+        budget = MemoryBudget(int_setting(settings, "memory_budget_mb", DEFAULT_MEMORY_BUDGET_MB))
+        self.frame_store = FrameStore(self.pool, budget,
+                                      int_setting(settings, "disk_cache_total_mb", DEFAULT_DISK_CACHE_TOTAL_MB))
+        self.registry = InstanceRegistry()
+        self.control = ControlServer(self)
+        self.desklets = {}
+        # Instâncias esperando os cabeçalhos do GIF para criar o desklet
+        self.starting = set()
+        # No autostart não há janela de controle: sem desklets, o processo termina
+        self.quit_when_empty = False
+
+        # Configurar manipulador de sinal para fechar os sockets ao encerrar
+        signal.signal(signal.SIGTERM, self.handle_shutdown)
+        signal.signal(signal.SIGHUP, self.handle_shutdown)
+
+    def add(self, desklet):
+        self.desklets[desklet.name] = desklet
+        try:
+            self.control.listen(desklet.name)
+        except Exception as e:
+            logging.error(f"Failed to open control socket for instance {desklet.name}: {e}")
+
+    def remove(self, desklet):
+        if self.desklets.get(desklet.name) is desklet:
+            del self.desklets[desklet.name]
+            self.control.unlisten(desklet.name)
+        self.quit_if_empty()
+
+    def quit_if_empty(self):
+        if self.quit_when_empty and not self.desklets and not self.starting:
+            logging.debug("No desklets left, quitting main loop")
+            self.shutdown()
+            Gtk.main_quit()
+
+    def instance_settings(self, name):
+        config = configparser.ConfigParser()
+        if os.path.exists(CONFIG_FILE):
+            config.read(CONFIG_FILE)
+        section = instance_section(name)
+        if section not in config:
+            raise ValueError(f"Unknown instance: {name}")
+        settings = config[section]
+        gif_path = settings.get("gif_path", "")
+        if not gif_path or not os.path.isfile(gif_path):
+            raise ValueError(f"Invalid or missing GIF path for instance {name}: {gif_path}")
+        return settings
+
+    def start(self, name, on_progress=None):
+        if name in self.desklets or name in self.starting or self.registry.is_running(name):
+            raise RuntimeError(f"Instance {name} is already running")
+        create_desklet(name, self.instance_settings(name), self, on_progress)
+
+    def stop(self, name):
+        desklet = self.desklets.get(name)
+        if desklet is None and name in self.starting:
+            # Ainda esperando os cabeçalhos: o desklet não chega a ser criado
+            self.starting.discard(name)
+            self.quit_if_empty()
+            return
+        if desklet is None:
+            raise ValueError(f"Instance {name} is not running in this process")
+        desklet.destroy()
+
+    def reload(self, name):
+        # Aplica as configurações atuais do INI ao desklet em execução
+        desklet = self.desklets.get(name)
+        if desklet is None:
+            raise ValueError(f"Instance {name} is not running in this process")
+        desklet.reconfigure(self.instance_settings(name))
+
+    def shutdown(self):
+        self.control.close()
+        self.pool.shutdown()
+        get_config_writer().flush()
+
+    def handle_shutdown(self, signum, frame):
+        logging.debug(f"Received signal {signum}, shutting down {len(self.desklets)} Desklet(s)")
+        for desklet in list(self.desklets.values()):
+            desklet.destroy()
+
+class StartupReport:
+    # Tempos de inicialização (--startup-report), em ms desde o início da
+    # importação do módulo. O relatório sai quando todos os desklets do
+    # processo tiverem pintado o primeiro frame
+    def __init__(self, output=None):
+        self.output = output
+        self.emitted = False
+        self.report = {"imports_ms": self.elapsed(STARTUP_IMPORTED), "first_pixel_ms": {}}
+
+    @staticmethod
+    def elapsed(now=None):
+        return round(((now or time.perf_counter()) - STARTUP_BEGIN) * 1000, 3)
+
+    def mark(self, name):
+        self.report[name] = self.elapsed()
+
+    def first_pixel(self, instance, hosted):
+        self.report["first_pixel_ms"].setdefault(instance, self.elapsed())
+        if self.emitted or any(name not in self.report["first_pixel_ms"] for name in hosted):
+            return
+        self.emitted = True
+        text = json.dumps(self.report, indent=2)
+        logging.info(f"Startup report: {json.dumps(self.report)}")
+        if self.output:
+            with open(self.output, "w") as f:
+                f.write(text + "\n")
+        else:
+            print(text, flush=True)
+
+_startup_report = None
+
+_host = None
+
+def get_host():
+    global _host
+    if _host is None:
+        _host = DeskletHost(general_settings())
+    return _host
+
+def create_desklet(name, settings, host=None, on_progress=None, on_error=None):
+    # Cria o desklet de uma instância a partir da sua seção do INI, assim que
+    # os cabeçalhos do GIF forem lidos (nos modos de processo, num worker).
+    # Uma falha, aqui ou no worker, chega a on_error(mensagem)
+    host = host or get_host()
+    placement = placement_options(settings)
+    options = desklet_options(settings)
+    logging.debug(f"Settings for instance {name}: {placement}")
+
+    def create(error):
+        if name not in host.starting:
+            # Parado antes de nascer
+            return
+        host.starting.discard(name)
+        if error is None:
+            try:
+                GifDesklet(name=name, host=host, on_progress=on_progress, on_error=on_error, **placement, **options)
+                return
+            except Exception as e:
+                error = str(e) or type(e).__name__
+        logging.error(f"Failed to start Desklet {name}: {error}")
+        if on_error is not None:
+            on_error(error)
+        host.quit_if_empty()
+
+    host.starting.add(name)
+    host.frame_store.prepare(placement["gif_path"], create)
+
+def paint_region(surface, pb, rect):
+    # Copia só a região alterada do pixbuf para a superfície persistente;
+    # new_subpixbuf compartilha os pixels, então só essa região é convertida
+    x, y, w, h = rect
+    cr = cairo.Context(surface)
+    Gdk.cairo_set_source_pixbuf(cr, pb.new_subpixbuf(x, y, w, h), x, y)
+    cr.set_operator(cairo.OPERATOR_SOURCE)
+    cr.rectangle(x, y, w, h)
+    cr.fill()
+    surface.flush()
 
 class GifDesklet(Gtk.Window):
-    def __init__(self, gif_path, monitor_index, position, margin, lock_file, custom_x=None, custom_y=None):
-        logging.debug(f"Starting GifDesklet with gif_path={gif_path}, monitor={monitor_index}, position={position}, margin={margin}, custom_x={custom_x}, custom_y={custom_y}")
+    def __init__(self, gif_path, monitor_index, position, margin, name=DEFAULT_INSTANCE, custom_x=None, custom_y=None,
+                 frame_memory_mb=DEFAULT_FRAME_MEMORY_MB, pixbuf_cache_mb=DEFAULT_PIXBUF_CACHE_MB,
+                 disk_cache_mb=DEFAULT_DISK_CACHE_MB, render_mode="full", playback_policy=None, system_state=None,
+                 host=None, scale=1.0, target_width=0, target_height=0, resample="lanczos",
+                 palette_memory_mb=DEFAULT_PALETTE_MEMORY_MB, on_progress=None, on_error=None, watch_file=False,
+                 speed=1.0, max_fps=0, loops="forever"):
+        logging.debug(f"Starting GifDesklet {name} with gif_path={gif_path}, monitor={monitor_index}, position={position}, margin={margin}, custom_x={custom_x}, custom_y={custom_y}, render_mode={render_mode}")
         Gtk.Window.__init__(self, title="GIF Desklet")
 
         self.set_app_paintable(True)
@@ -36,31 +2769,175 @@ class GifDesklet(Gtk.Window):
         if visual is not None:
             self.set_visual(visual)
 
-        self.image = Gtk.Image()
-        self.add(self.image)
+        self.name = name
+        self.closed = False
+        self.host = host or get_host()
+        self.stats = DeskletStats()
+        self.on_progress = on_progress
+        # on_error(mensagem): a decodificação falhou (o desklet se fecha se ainda não tinha frames)
+        self.on_error = on_error
+        self.first_paint_id = None
+        self.painted = False
+        # Frames dos quais se espera um frame que ainda não chegou do pool de processos
+        self.waiting_frames = None
 
+        # Velocidade e repetições mudam só a animação; o limite de FPS decide
+        # quais frames são guardados
+        self.speed = speed
+        self.loops = loops
+
+        # Em monitores HiDPI os frames são gerados em pixels do dispositivo
+        self.monitors = get_monitor_layout()
+        self.placed_on = None
+        self.device_scale = self.monitors.scale_factor(monitor_index)
+        self.frame_options = {
+            "gif_path": gif_path, "scale": scale, "target_width": target_width, "target_height": target_height,
+            "resample": resample, "frame_memory_mb": frame_memory_mb, "pixbuf_cache_mb": pixbuf_cache_mb,
+            "disk_cache_mb": disk_cache_mb, "palette_memory_mb": palette_memory_mb,
+            "min_interval_ms": min_frame_interval_ms(max_fps, speed),
+        }
+        self.frames_key, self.frames, self.pixbufs = self.acquire_frames(self.frame_options, self.device_scale)
+        # Frames de um reload que ainda estão sendo decodificados: os atuais
+        # continuam na tela até eles ficarem prontos
+        self.pending = None
+        # Chave de um reload cujos cabeçalhos ainda estão sendo lidos
+        self.preparing = None
+
+        # "full" troca o pixbuf inteiro a cada frame; "delta" mantém uma
+        # superfície persistente e redesenha só a região que mudou
+        self.render_mode = None
+        self.view = None
+        self.set_render_mode(render_mode)
+        self.resize_to_frames()
+
+        # Posiciona janela
+        self.set_placement(monitor_index, position, margin, custom_x, custom_y)
+        self.show_all()
+
+        # Registrar a instância (abre o seu socket de controle)
+        self.host.add(self)
+
+        # Arrastar só tem efeito com posição custom
+        self.is_dragging = False
+        self.drag_start_x = 0
+        self.drag_start_y = 0
+        # Movimentos do mouse entre dois ticks do frame clock viram um só move()
+        self.drag_target = None
+        self.drag_tick_id = None
+        self.connect("button-press-event", self.on_button_press)
+        self.connect("button-release-event", self.on_button_release)
+        self.connect("motion-notify-event", self.on_motion_notify)
+        self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK |
+                        Gdk.EventMask.BUTTON_RELEASE_MASK |
+                        Gdk.EventMask.POINTER_MOTION_MASK)
+
+        self.animation = self.new_animation()
+        if on_progress is not None:
+            self.frames.add_progress_listener(on_progress)
+
+        # Pausar ou desacelerar quando ninguém pode ver o desklet
+        self.playback_policy = playback_policy or PlaybackPolicy()
+        self.system_state = system_state or get_system_state()
+        self.hidden = False
+        self.obscured = False
+        self.connect("map-event", self.on_map_changed)
+        self.connect("unmap-event", self.on_map_changed)
+        self.connect("window-state-event", self.on_map_changed)
+        # visibility-notify-event está obsoleto e só chega em X11 sem
+        # compositor; com compositor (e no Wayland) só unmap, minimizar,
+        # bloqueio, ociosidade e bateria pausam a animação
+        self.connect("visibility-notify-event", self.on_visibility_notify)
+        self.add_events(Gdk.EventMask.VISIBILITY_NOTIFY_MASK | Gdk.EventMask.STRUCTURE_MASK)
+        self.system_state.connect(self.on_system_state_changed)
+        self.apply_playback_policy()
+        self.monitors.connect(self.on_monitors_changed)
+
+        # Opcionalmente, recarregar o GIF quando o arquivo mudar
+        self.file_monitor = None
+        self.watch_source_id = None
+        self.set_watch_file(watch_file)
+
+        # A animação começa quando o primeiro frame fica pronto; o restante
+        # continua sendo decodificado em segundo plano. Por último: se a
+        # decodificação já falhou, o callback roda aqui mesmo e fecha o desklet
+        self.frames.when_ready(self.animation.frame_index, self.on_first_frame_ready)
+
+    def acquire_frames(self, options, device_scale):
+        scaling = FrameScaling(options["scale"], options["target_width"], options["target_height"],
+                               options["resample"], device_scale)
+        return self.host.frame_store.acquire(
+            options["gif_path"], frame_memory_mb=options["frame_memory_mb"],
+            pixbuf_cache_mb=options["pixbuf_cache_mb"], disk_cache_mb=options["disk_cache_mb"],
+            scaling=scaling, palette_memory_mb=options["palette_memory_mb"],
+            min_interval_ms=options["min_interval_ms"])
+
+    def new_animation(self):
+        return Animation(self.frames, self.update_frame, self.host.scheduler, self.speed, self.loop_limit())
+
+    def loop_limit(self):
+        # Número de voltas antes de parar, ou None para repetir sempre
+        if self.loops == "forever":
+            return None
+        if self.loops == "file":
+            # Cada formato conta as repetições do seu jeito; o decodificador converte
+            return self.frames.plays
         try:
-            self.pil_gif = Image.open(gif_path)
-        except Exception as e:
-            logging.error(f"Failed to open GIF file {gif_path}: {e}")
-            raise
+            loops = int(self.loops)
+        except ValueError:
+            logging.warning(f"Invalid loops setting {self.loops!r}, looping forever")
+            return None
+        return loops if loops > 0 else None
 
-        self.frames = []
-        self.durations = []
+    def logical_size(self):
+        return self.frames.logical_size
 
-        for frame in ImageSequence.Iterator(self.pil_gif):
-            self.frames.append(frame.convert("RGBA").copy())
-            duration = frame.info.get("duration", 100)
-            self.durations.append(duration)
+    def pixel_ratio(self):
+        # Pixels do frame por pixel lógico; 1 quando o frame já está no tamanho da tela
+        (w, h), (lw, lh) = self.frames.size, self.frames.logical_size
+        return w / lw, h / lh
 
-        self.frame_index = 0
-        self.running = True
+    def set_render_mode(self, render_mode):
+        render_mode = render_mode if render_mode in RENDER_MODES else "full"
+        if render_mode == self.render_mode:
+            return
+        if self.view is not None:
+            self.remove(self.view)
+            self.view.destroy()
+        if render_mode == "delta":
+            self.surface = None
+            self.shown_index = None
+            self.canvas = Gtk.DrawingArea()
+            self.canvas.connect("draw", self.on_draw)
+            self.view = self.canvas
+        else:
+            self.image = Gtk.Image()
+            self.view = self.image
+        self.render_mode = render_mode
+        self.add(self.view)
+        self.view.show()
 
-        self.set_default_size(self.frames[0].width, self.frames[0].height)
+    def resize_to_frames(self):
+        w, h = self.logical_size()
+        self.set_default_size(w, h)
+        self.view.set_size_request(w, h)
+        self.resize(w, h)
+        if self.render_mode == "delta":
+            # A superfície é recriada no tamanho novo no próximo frame
+            self.surface = None
+            self.shown_index = None
 
-        # Posiciona janela
-        monitor = screen.get_monitor_geometry(monitor_index)
-        w, h = self.frames[0].size
+    def set_placement(self, monitor_index, position, margin, custom_x=None, custom_y=None):
+        self.monitor_index = monitor_index
+        self.position = position
+        self.margin = margin
+        self.custom_x = custom_x
+        self.custom_y = custom_y
+        self.place()
+
+    def place(self):
+        w, h = self.logical_size()
+        monitor = self.placed_on = self.monitors.geometry(self.monitor_index)
+        position, margin, custom_x, custom_y = self.position, self.margin, self.custom_x, self.custom_y
 
         if position == "custom":
             # Validar custom_x e custom_y
@@ -90,127 +2967,425 @@ class GifDesklet(Gtk.Window):
             x = monitor.x
             y = monitor.y
 
-        logging.debug(f"Positioning Desklet at x={x}, y={y} on monitor {monitor_index}")
+        logging.debug(f"Positioning Desklet at x={x}, y={y} on monitor {self.monitor_index}")
         self.move(x, y)
-        self.show_all()
 
-        # Criar arquivo de lock com o PID
-        self.lock_file = lock_file
+    def reconfigure(self, settings):
+        # Aplica uma seção do INI ao desklet em execução, sem recriar a janela.
+        # Posição, monitor, política de reprodução e modo de desenho mudam na
+        # hora; frames novos (outro GIF, outro tamanho) são decodificados em
+        # segundo plano e só substituem os atuais quando estiverem prontos
+        placement = placement_options(settings)
+        options = desklet_options(settings)
+        logging.debug(f"Reconfiguring Desklet {self.name}: {placement}, {options}")
+
+        self.playback_policy = options["playback_policy"]
+        self.apply_playback_policy()
+
+        if options["render_mode"] != self.render_mode:
+            self.set_render_mode(options["render_mode"])
+            self.resize_to_frames()
+            if self.animation.running:
+                self.update_frame(self.animation.frame_index)
+
+        self.speed = options["speed"]
+        self.loops = options["loops"]
+        self.animation.set_speed(self.speed)
+        self.animation.set_loops(self.loop_limit())
+
+        frame_options = {key: options[key] for key in self.frame_options if key in options}
+        frame_options["gif_path"] = placement.pop("gif_path")
+        frame_options["min_interval_ms"] = min_frame_interval_ms(options["max_fps"], self.speed)
+        device_scale = self.monitors.scale_factor(placement["monitor_index"])
+        self.set_placement(**placement)
+        self.set_watch_file(options["watch_file"], frame_options["gif_path"])
+        self.load_frames(frame_options, device_scale)
+
+    def load_frames(self, options, device_scale):
+        scaling = FrameScaling(options["scale"], options["target_width"], options["target_height"],
+                               options["resample"], device_scale)
         try:
-            with open(self.lock_file, "w") as f:
-                f.write(str(os.getpid()))
-            logging.debug(f"Created lock file {self.lock_file} with PID {os.getpid()}")
+            key = self.host.frame_store.key(options["gif_path"], scaling, options["min_interval_ms"])
+        except OSError as e:
+            logging.error(f"Cannot reload {options['gif_path']} for Desklet {self.name}: {e}")
+            return
+        self.frame_options = options
+        if key == self.frames_key:
+            self.release_pending()
+            return
+        if (self.pending is not None and self.pending[0] == key) or self.preparing == key:
+            return
+
+        self.release_pending()
+        # Os cabeçalhos de um GIF novo são lidos antes, sem bloquear o GTK
+        self.preparing = key
+        self.host.frame_store.prepare(options["gif_path"],
+                                      lambda error: self.on_prepared(key, options, device_scale, error))
+
+    def on_prepared(self, key, options, device_scale, error):
+        if self.closed or self.preparing != key:
+            return
+        self.preparing = None
+        if error is not None:
+            # Os frames atuais continuam; repetir o reload volta a tentar
+            logging.error(f"Failed to load {options['gif_path']} for Desklet {self.name}: {error}")
+            self.report_error(error)
+            return
+        try:
+            key, frames, pixbufs = self.acquire_frames(options, device_scale)
         except Exception as e:
-            logging.error(f"Failed to create lock file {self.lock_file}: {e}")
+            logging.error(f"Failed to load {options['gif_path']} for Desklet {self.name}: {e}")
+            return
+        pending = self.pending = (key, frames, pixbufs, device_scale)
+        logging.debug(f"Desklet {self.name} decoding {options['gif_path']} in the background before swapping")
+        if self.on_progress is not None:
+            frames.add_progress_listener(self.on_progress)
+        frames.when_complete(lambda: self.on_pending_ready(pending))
 
-        # Habilitar arrastar se posição for custom
-        self.is_dragging = False
-        self.drag_start_x = 0
-        self.drag_start_y = 0
-        if position == "custom":
-            self.connect("button-press-event", self.on_button_press)
-            self.connect("button-release-event", self.on_button_release)
-            self.connect("motion-notify-event", self.on_motion_notify)
-            self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK |
-                           Gdk.EventMask.BUTTON_RELEASE_MASK |
-                           Gdk.EventMask.POINTER_MOTION_MASK)
-
-        # Configurar manipulador de sinal para limpar o lock file ao encerrar
-        signal.signal(signal.SIGTERM, self.handle_shutdown)
-        signal.signal(signal.SIGHUP, self.handle_shutdown)
+    def on_monitors_changed(self, changed):
+        # Só reage se o monitor deste desklet mudou (ou sumiu e ele caiu no principal)
+        monitor = self.monitors.geometry(self.monitor_index)
+        if self.closed or monitor == self.placed_on:
+            return
+        if monitor.scale != self.device_scale:
+            self.rescale(monitor.scale)
+        self.place()
 
-        threading.Thread(target=self.update_loop, daemon=True).start()
+    def rescale(self, device_scale):
+        # Troca na hora por frames redimensionados a partir dos já decodificados.
+        # Ao aumentar a escala eles perdem nitidez: frames no tamanho nativo
+        # são decodificados em segundo plano e os substituem quando prontos
+        old_scale = self.device_scale
+        reload = self.pending is not None or self.preparing is not None
+        self.release_pending()
+        # O mesmo limite da decodificação: nunca acima da resolução do GIF
+        (w, h), (sw, sh) = self.logical_size(), self.frames.source_size
+        size = (min(sw, w * device_scale), min(sh, h * device_scale))
+        upscaled = size[0] > self.frames.size[0] or size[1] > self.frames.size[1]
+        old_key = self.frames_key
+        previous = self.animation
+        previous.stop()
+        self.frames_key, self.frames, self.pixbufs = self.host.frame_store.rescale(
+            old_key, size, self.frame_options["resample"], self.frame_options["pixbuf_cache_mb"])
+        self.device_scale = device_scale
+        self.resize_to_frames()
+        # Os mesmos frames em outro tamanho: continuar de onde parou
+        self.animation = self.new_animation()
+        self.animation.frame_index = previous.frame_index
+        self.animation.loops_done = previous.loops_done
+        self.apply_playback_policy()
+        self.animation.start()
+        self.host.frame_store.release(old_key, self.name)
+        logging.info(f"Desklet {self.name} rescaled from {old_scale}x to {device_scale}x")
+        if reload or upscaled:
+            self.load_frames(self.frame_options, device_scale)
 
-    def handle_shutdown(self, signum, frame):
-        logging.debug(f"Received signal {signum}, shutting down Desklet")
-        self.destroy()
+    def on_pending_ready(self, pending):
+        if self.closed or self.pending is not pending:
+            return False
+        if pending[1].error is not None:
+            # Os frames atuais continuam; repetir o reload volta a tentar
+            logging.error(f"Failed to reload {pending[1].gif_path} for Desklet {self.name}: {pending[1].error}")
+            self.release_pending()
+            self.report_error(pending[1].error)
+            return False
+        self.pending = None
+        old_key = self.frames_key
+        self.animation.stop()
+        self.frames_key, self.frames, self.pixbufs, self.device_scale = pending
+        self.resize_to_frames()
+        self.place()
+        self.animation = self.new_animation()
+        self.apply_playback_policy()
+        self.animation.start()
+        # Liberar por último: se a chave for compartilhada, nada é redecodificado
+        self.host.frame_store.release(old_key, self.name)
+        logging.debug(f"Desklet {self.name} swapped to {self.frames.gif_path}")
+        return False
+
+    def release_pending(self):
+        self.preparing = None
+        if self.pending is not None:
+            self.host.frame_store.release(self.pending[0], self.name)
+            self.pending = None
+
+    def set_watch_file(self, enabled, gif_path=None):
+        gif_path = gif_path or self.frame_options["gif_path"]
+        if self.file_monitor is not None and (not enabled or self.watched_path != gif_path):
+            self.file_monitor.cancel()
+            self.file_monitor = None
+        if enabled and self.file_monitor is None:
+            # GFileMonitor usa inotify e também percebe o arquivo sendo
+            # substituído por rename, como fazem a maioria dos editores
+            self.watched_path = gif_path
+            self.file_monitor = Gio.File.new_for_path(gif_path).monitor_file(Gio.FileMonitorFlags.WATCH_MOVES, None)
+            self.file_monitor.connect("changed", self.on_file_changed)
+            logging.debug(f"Watching {gif_path} for changes")
+
+    def on_file_changed(self, monitor, file, other_file, event):
+        if event not in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED,
+                         Gio.FileMonitorEvent.RENAMED, Gio.FileMonitorEvent.MOVED_IN):
+            return
+        # Esperar o arquivo parar de mudar antes de decodificar
+        if self.watch_source_id is not None:
+            GLib.source_remove(self.watch_source_id)
+        self.watch_source_id = GLib.timeout_add(WATCH_DELAY_MS, self.on_watched_file_settled)
+
+    def on_watched_file_settled(self):
+        self.watch_source_id = None
+        if not self.closed and os.path.isfile(self.watched_path):
+            logging.debug(f"{self.watched_path} changed, reloading Desklet {self.name}")
+            self.load_frames(self.frame_options, self.device_scale)
+        return False
+
+    def on_first_frame_ready(self):
+        if self.closed:
+            return False
+        if self.frames.error is not None:
+            # Sem nenhum frame para mostrar: fechar em vez de ficar em branco
+            logging.error(f"Failed to decode {self.frames.gif_path} for Desklet {self.name}: {self.frames.error}")
+            error = self.frames.error
+            self.destroy()
+            self.report_error(error)
+            return False
+        logging.debug(f"First frame of Desklet {self.name} ready")
+        self.animation.start()
+        return False
+
+    def report_error(self, message):
+        if self.on_error is not None:
+            self.on_error(message)
+
+    def on_map_changed(self, widget, event):
+        window = self.get_window()
+        state = window.get_state() if window is not None else Gdk.WindowState.WITHDRAWN
+        self.hidden = (not self.get_mapped() or
+                       bool(state & (Gdk.WindowState.ICONIFIED | Gdk.WindowState.WITHDRAWN)))
+        self.apply_playback_policy()
+        return False
+
+    def on_visibility_notify(self, widget, event):
+        self.obscured = event.state == Gdk.VisibilityState.FULLY_OBSCURED
+        self.apply_playback_policy()
+        return False
+
+    def on_system_state_changed(self, state):
+        self.apply_playback_policy()
+
+    def apply_playback_policy(self):
+        paused, slowdown = self.playback_policy.decide(self.hidden or self.obscured, self.system_state)
+        if paused != self.animation.paused:
+            logging.debug(f"Animation {'paused' if paused else 'resumed'} (hidden={self.hidden}, obscured={self.obscured}, locked={self.system_state.locked}, idle={self.system_state.idle}, on_battery={self.system_state.on_battery})")
+        self.animation.set_slowdown(slowdown)
+        if paused:
+            self.animation.pause()
+        else:
+            self.animation.resume()
 
     def on_button_press(self, widget, event):
-        if event.button == 1:  # Botão esquerdo do mouse
+        if event.button == 1 and self.position == "custom":  # Botão esquerdo do mouse
             self.is_dragging = True
             self.drag_start_x = event.x_root - self.get_position()[0]
             self.drag_start_y = event.y_root - self.get_position()[1]
-            logging.debug(f"Started dragging at x={event.x_root}, y={event.y_root}")
+            log_throttled("drag-start", logging.DEBUG, f"Started dragging at x={event.x_root}, y={event.y_root}")
         return True
 
     def on_button_release(self, widget, event):
-        if event.button == 1:
+        if event.button == 1 and self.is_dragging:
             self.is_dragging = False
-            x, y = self.get_position()
-            logging.debug(f"Stopped dragging, new position x={x}, y={y}")
-            # Salvar nova posição no arquivo de configuração
-            config_dir = os.path.expanduser("~/.gif_desklet")
-            config_file = os.path.join(config_dir, "gif_desklet.ini")
-            config = configparser.ConfigParser()
-            if os.path.exists(config_file):
-                config.read(config_file)
-                if "Desklet" in config:
-                    config["Desklet"]["custom_x"] = str(x)
-                    config["Desklet"]["custom_y"] = str(y)
-                    with open(config_file, "w") as f:
-                        config.write(f)
-                    logging.debug(f"Saved custom position x={x}, y={y}")
+            # Aplicar o último movimento ainda pendente antes de ler a posição
+            if self.drag_tick_id is not None:
+                self.remove_tick_callback(self.drag_tick_id)
+                self.on_drag_tick(self, None)
+            x, y = self.drag_target or self.get_position()
+            self.drag_target = None
+            self.custom_x, self.custom_y = x, y
+            log_throttled("drag-stop", logging.DEBUG, f"Stopped dragging, new position x={x}, y={y}")
+            # Salvar nova posição na seção desta instância, fora da thread do GTK
+            get_config_writer().update(instance_section(self.name), {"custom_x": str(x), "custom_y": str(y)})
         return True
 
     def on_motion_notify(self, widget, event):
         if self.is_dragging:
-            new_x = int(event.x_root - self.drag_start_x)
-            new_y = int(event.y_root - self.drag_start_y)
-            self.move(new_x, new_y)
+            self.drag_target = (int(event.x_root - self.drag_start_x), int(event.y_root - self.drag_start_y))
+            if self.drag_tick_id is None:
+                self.drag_tick_id = self.add_tick_callback(self.on_drag_tick)
         return True
 
-    def update_loop(self):
-        while self.running:
-            GLib.idle_add(self.update_frame)
-            time.sleep(self.durations[self.frame_index] / 1000.0)
-            self.frame_index = (self.frame_index + 1) % len(self.frames)
+    def on_drag_tick(self, widget, frame_clock):
+        self.drag_tick_id = None
+        if self.drag_target is not None:
+            self.move(*self.drag_target)
+        return GLib.SOURCE_REMOVE
+
+    def update_frame(self, index):
+        started = time.perf_counter()
+        # Cada desklet tem sua própria janela nos frames compartilhados
+        pb = self.pixbufs.get(index, self.name)
+        if pb is None:
+            # O frame ainda não chegou do pool de processos: o atual continua
+            # na tela e o quadro é redesenhado quando ele chegar
+            self.wait_for_frame(index)
+            return
+        if self.render_mode == "delta":
+            self.update_surface(index, pb)
+        elif self.pixel_ratio() != (1, 1):
+            # O pixbuf não está em pixels lógicos; a superfície informa a
+            # escala ao GTK e fica no cache, como o pixbuf
+            self.image.set_from_surface(self.pixbufs.get_surface(index, self.pixel_ratio(), self.name))
+        else:
+            self.image.set_from_pixbuf(pb)
+        self.stats.record(self.animation.last_lateness, time.perf_counter() - started)
+        if not self.painted:
+            self.painted = True
+            if _startup_report is not None:
+                self.watch_first_paint()
+
+    def wait_for_frame(self, index):
+        if self.frames.error is not None:
+            log_throttled(f"frame-missing-{self.name}", logging.WARNING,
+                          f"Desklet {self.name} has no frame {index} to show: {self.frames.error}")
+            return
+        # Frames trocados (recarga, nova escala) no meio da espera não a bloqueiam
+        if self.waiting_frames is self.frames:
+            return
+        frames = self.waiting_frames = self.frames
+        frames.when_ready(index, lambda: self.on_frame_arrived(frames))
 
-    def update_frame(self):
-        frame = self.frames[self.frame_index]
-        data = frame.tobytes()
-        width, height = frame.size
+    def on_frame_arrived(self, frames):
+        if self.waiting_frames is not frames:
+            return False
+        self.waiting_frames = None
+        if not self.closed:
+            self.update_frame(self.animation.frame_index)
+        return False
 
-        pb = GdkPixbuf.Pixbuf.new_from_data(
-            data,
-            GdkPixbuf.Colorspace.RGB,
-            True,
-            8,
-            width,
-            height,
-            width * 4,
-        )
-        self.image.set_from_pixbuf(pb)
+    def watch_first_paint(self):
+        # O primeiro pixel só existe depois que o GTK pinta a janela
+        clock = self.get_frame_clock()
+        if clock is None:
+            _startup_report.first_pixel(self.name, list(self.host.desklets))
+            return
+        self.first_paint_id = clock.connect("after-paint", self.on_first_paint)
+
+    def on_first_paint(self, clock):
+        clock.disconnect(self.first_paint_id)
+        self.first_paint_id = None
+        _startup_report.first_pixel(self.name, list(self.host.desklets))
+
+    def stats_snapshot(self):
+        snapshot = self.stats.snapshot()
+        lookups = self.pixbufs.hits + self.pixbufs.misses
+        snapshot.update({
+            "gif_path": self.frames.gif_path,
+            "decoder": self.frames.decoder_name,
+            "render_mode": self.render_mode,
+            "paused": self.animation.paused,
+            "slowdown": self.animation.slowdown,
+            "dropped_frames": self.animation.skipped,
+            "decoded_frames": self.frames.decode_count,
+            "decode_ms_mean": round(self.frames.decode_seconds * 1000 / max(1, self.frames.decode_count), 3),
+            "pixbuf_hit_rate": round(self.pixbufs.hits / lookups, 4) if lookups else None,
+            "frame_memory_bytes": self.frames.memory_usage(),
+            "pixbuf_memory_bytes": self.pixbufs.bytes_used,
+        })
+        plan = self.host.frame_store.plan(self.frames_key)
+        if plan is not None:
+            snapshot["memory_plan"] = plan.describe()
+        return snapshot
+
+    def update_surface(self, index, pb):
+        w, h = self.frames.size
+        if self.surface is None:
+            self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+        rect = self.changed_rect(index)
+        self.shown_index = index
+        x, y, rw, rh = rect
+        if not rw or not rh:
+            return
+
+        paint_region(self.surface, pb, rect)
+        # A área invalidada é em coordenadas lógicas
+        sx, sy = self.pixel_ratio()
+        x0, y0 = math.floor(x / sx), math.floor(y / sy)
+        self.canvas.queue_draw_area(x0, y0, math.ceil((x + rw) / sx) - x0, math.ceil((y + rh) / sy) - y0)
+
+    def changed_rect(self, index):
+        w, h = self.frames.size
+        full = (0, 0, w, h)
+        if self.shown_index is None:
+            return full
+        # Frames pulados pelo agendador somam suas regiões
+        rect = (0, 0, 0, 0)
+        i = self.shown_index
+        while i != index:
+            i = (i + 1) % self.frames.frame_count
+            frame_rect = self.frames.get_dirty_rect(i)
+            if frame_rect is None:
+                return full
+            rect = union_rect(rect, frame_rect)
+        return rect
+
+    def on_draw(self, widget, cr):
+        if self.surface is not None:
+            # O GTK já restringe o desenho à área invalidada; a superfície
+            # está em pixels do frame
+            sx, sy = self.pixel_ratio()
+            cr.scale(1 / sx, 1 / sy)
+            cr.set_source_surface(self.surface, 0, 0)
+            cr.set_operator(cairo.OPERATOR_SOURCE)
+            cr.paint()
+        return False
 
     def destroy(self):
-        self.running = False
-        # Remover arquivo de lock
-        if os.path.exists(self.lock_file):
-            try:
-                os.remove(self.lock_file)
-                logging.debug(f"Removed lock file {self.lock_file}")
-            except Exception as e:
-                logging.error(f"Failed to remove lock file {self.lock_file}: {e}")
+        # Frames compartilhados não podem ser liberados duas vezes
+        if self.closed:
+            return
+        self.closed = True
+        self.animation.stop()
+        if self.drag_tick_id is not None:
+            self.remove_tick_callback(self.drag_tick_id)
+            self.drag_tick_id = None
+        self.set_watch_file(False)
+        if self.watch_source_id is not None:
+            GLib.source_remove(self.watch_source_id)
+            self.watch_source_id = None
+        self.release_pending()
+        if self.first_paint_id is not None:
+            self.get_frame_clock().disconnect(self.first_paint_id)
+            self.first_paint_id = None
+        self.system_state.disconnect(self.on_system_state_changed)
+        self.monitors.disconnect(self.on_monitors_changed)
+        self.host.frame_store.release(self.frames_key, self.name)
+        # Fecha o socket de controle da instância
+        self.host.remove(self)
         super().destroy()
 
 class Controller(Gtk.Window):
-    def __init__(self, has_desklet=False):
+    def __init__(self):
         logging.debug("Initializing Controller")
         Gtk.Window.__init__(self, title="Desklet Controller")
         self.set_border_width(10)
         self.set_default_size(400, 200)
 
-        # Indicador se há um desklet ativo (usado para gerenciar o loop principal)
-        self.has_desklet = has_desklet
-
-        # Caminho do arquivo de configuração e lock
-        self.config_dir = os.path.expanduser("~/.gif_desklet")
-        self.config_file = os.path.join(self.config_dir, "gif_desklet.ini")
-        self.lock_file = os.path.join(self.config_dir, "gif_desklet.lock")
+        # Caminho do arquivo de configuração e registro de instâncias
+        self.config_dir = CONFIG_DIR
+        self.config_file = CONFIG_FILE
         self.config = configparser.ConfigParser()
+        self.host = get_host()
+        self.registry = self.host.registry
+        self.loading = False
 
         grid = Gtk.Grid(column_spacing=10, row_spacing=10)
         self.add(grid)
 
+        # Instância (um nome novo digitado cria uma nova instância)
+        lbl_instance = Gtk.Label(label="Instance:")
+        self.combo_instance = Gtk.ComboBoxText.new_with_entry()
+        self.combo_instance.connect("changed", self.on_instance_changed)
+        btn_remove = Gtk.Button(label="Remove")
+        btn_remove.connect("clicked", self.on_remove_instance)
+
         # Caminho do GIF
         self.gif_path = None
         lbl_path = Gtk.Label(label="GIF Path:")
@@ -235,6 +3410,19 @@ class Controller(Gtk.Window):
         self.spin_margin = Gtk.SpinButton()
         self.spin_margin.set_adjustment(Gtk.Adjustment(value=20, lower=0, upper=200, step_increment=1, page_increment=0, page_size=0))
 
+        # Reprodução
+        lbl_speed = Gtk.Label(label="Speed (x):")
+        self.spin_speed = Gtk.SpinButton(digits=2)
+        self.spin_speed.set_adjustment(Gtk.Adjustment(value=1.0, lower=0.1, upper=10.0, step_increment=0.1, page_increment=0, page_size=0))
+        lbl_max_fps = Gtk.Label(label="Max FPS (0 = no cap):")
+        self.spin_max_fps = Gtk.SpinButton()
+        self.spin_max_fps.set_adjustment(Gtk.Adjustment(value=0, lower=0, upper=120, step_increment=1, page_increment=0, page_size=0))
+        lbl_loops = Gtk.Label(label="Loops:")
+        self.combo_loops = Gtk.ComboBoxText.new_with_entry()
+        for loops in LOOP_MODES:
+            self.combo_loops.append_text(loops)
+        self.combo_loops.set_tooltip_text("forever, file (use the GIF's loop count) or a number of loops")
+
         # Autostart
         lbl_autostart = Gtk.Label(label="Autostart on login:")
         self.check_autostart = Gtk.CheckButton()
@@ -248,60 +3436,103 @@ class Controller(Gtk.Window):
         self.btn_start.connect("clicked", self.on_start)
         self.btn_stop.connect("clicked", self.on_stop)
 
+        # Progresso da decodificação em segundo plano
+        self.progress = Gtk.ProgressBar(show_text=True)
+        self.progress.set_no_show_all(True)
+
         # Layout
-        grid.attach(lbl_path, 0, 0, 1, 1)
-        grid.attach(self.entry_path, 1, 0, 2, 1)
-        grid.attach(btn_browse, 3, 0, 1, 1)
+        grid.attach(lbl_instance, 0, 0, 1, 1)
+        grid.attach(self.combo_instance, 1, 0, 2, 1)
+        grid.attach(btn_remove, 3, 0, 1, 1)
 
-        grid.attach(lbl_monitor, 0, 1, 1, 1)
-        grid.attach(self.spin_monitor, 1, 1, 1, 1)
+        grid.attach(lbl_path, 0, 1, 1, 1)
+        grid.attach(self.entry_path, 1, 1, 2, 1)
+        grid.attach(btn_browse, 3, 1, 1, 1)
 
-        grid.attach(lbl_position, 0, 2, 1, 1)
-        grid.attach(self.combo_position, 1, 2, 1, 1)
+        grid.attach(lbl_monitor, 0, 2, 1, 1)
+        grid.attach(self.spin_monitor, 1, 2, 1, 1)
 
-        grid.attach(lbl_margin, 0, 3, 1, 1)
-        grid.attach(self.spin_margin, 1, 3, 1, 1)
+        grid.attach(lbl_position, 0, 3, 1, 1)
+        grid.attach(self.combo_position, 1, 3, 1, 1)
 
-        grid.attach(lbl_autostart, 0, 4, 1, 1)
-        grid.attach(self.check_autostart, 1, 4, 1, 1)
+        grid.attach(lbl_margin, 0, 4, 1, 1)
+        grid.attach(self.spin_margin, 1, 4, 1, 1)
 
-        grid.attach(self.btn_start, 0, 5, 2, 1)
-        grid.attach(self.btn_stop, 2, 5, 2, 1)
+        grid.attach(lbl_speed, 0, 5, 1, 1)
+        grid.attach(self.spin_speed, 1, 5, 1, 1)
 
-        self.desklet = None
+        grid.attach(lbl_max_fps, 0, 6, 1, 1)
+        grid.attach(self.spin_max_fps, 1, 6, 1, 1)
 
-        # Carregar configurações salvas
-        self.load_settings()
+        grid.attach(lbl_loops, 0, 7, 1, 1)
+        grid.attach(self.combo_loops, 1, 7, 1, 1)
 
-        # Verificar se há uma instância em execução
-        self.check_running_instance()
+        grid.attach(lbl_autostart, 0, 8, 1, 1)
+        grid.attach(self.check_autostart, 1, 8, 1, 1)
 
-    def load_settings(self):
-        logging.debug(f"Loading settings from {self.config_file}")
-        # Criar diretório de configuração se não existir
-        pathlib.Path(self.config_dir).mkdir(parents=True, exist_ok=True)
+        grid.attach(self.btn_start, 0, 9, 2, 1)
+        grid.attach(self.btn_stop, 2, 9, 2, 1)
+
+        grid.attach(self.progress, 0, 10, 4, 1)
+
+        # Desklets hospedados neste processo, por nome de instância
+        self.desklets = self.host.desklets
+
+        # Carregar configurações salvas
+        self.load_settings()
 
-        # Valores padrão
-        default_settings = {
+    def default_settings(self):
+        return {
             "gif_path": "",
             "monitor": "0",
             "position": "bottom-right",
             "margin": "20",
             "autostart": "False",
             "custom_x": "0",
-            "custom_y": "0"
+            "custom_y": "0",
+            "frame_memory_mb": str(DEFAULT_FRAME_MEMORY_MB),
+            "palette_memory_mb": str(DEFAULT_PALETTE_MEMORY_MB),
+            "pixbuf_cache_mb": str(DEFAULT_PIXBUF_CACHE_MB),
+            "disk_cache_mb": str(DEFAULT_DISK_CACHE_MB),
+            "render_mode": "full",
+            "pause_when_hidden": "True",
+            "pause_when_locked": "True",
+            "pause_when_idle": "False",
+            "battery_mode": "slow",
+            "battery_slowdown": "2.0",
+            "speed": "1.0",
+            "max_fps": "0",
+            "loops": "forever"
         }
 
+    def current_instance(self):
+        name = self.combo_instance.get_child().get_text().strip()
+        return name or DEFAULT_INSTANCE
+
+    def load_settings(self):
+        logging.debug(f"Loading settings from {self.config_file}")
+        # Criar diretório de configuração se não existir
+        pathlib.Path(self.config_dir).mkdir(parents=True, exist_ok=True)
+
         # Ler configurações do arquivo, se existir
         if os.path.exists(self.config_file):
             self.config.read(self.config_file)
-            if "Desklet" not in self.config:
-                self.config["Desklet"] = default_settings
-        else:
-            self.config["Desklet"] = default_settings
+        if not instance_names(self.config):
+            self.config["Desklet"] = self.default_settings()
 
-        # Aplicar configurações na GUI
-        settings = self.config["Desklet"]
+        self.loading = True
+        self.combo_instance.remove_all()
+        for name in instance_names(self.config):
+            self.combo_instance.append_text(name)
+        self.loading = False
+        # Selecionar a primeira instância dispara on_instance_changed
+        self.combo_instance.set_active(0)
+
+    def load_instance(self, name):
+        # Aplicar configurações da instância na GUI
+        self.loading = True
+        section = instance_section(name)
+        settings = self.config[section] if section in self.config else self.default_settings()
         self.entry_path.set_text(settings.get("gif_path", ""))
         self.spin_monitor.set_value(int(settings.get("monitor", "0")))
         position = settings.get("position", "bottom-right")
@@ -310,53 +3541,86 @@ class Controller(Gtk.Window):
                 self.combo_position.set_active(i)
                 break
         self.spin_margin.set_value(int(settings.get("margin", "20")))
+        self.spin_speed.set_value(float(settings.get("speed", "1.0")))
+        self.spin_max_fps.set_value(float(settings.get("max_fps", "0")))
+        self.combo_loops.get_child().set_text(settings.get("loops", "forever"))
         self.check_autostart.set_active(settings.get("autostart", "False").lower() == "true")
-        logging.debug(f"Loaded settings: {settings}")
+        self.loading = False
+        logging.debug(f"Loaded settings for instance {name}: {dict(settings)}")
+
+        # Verificar se há uma instância em execução
+        self.check_running_instance()
+
+    def on_instance_changed(self, widget):
+        # Só trocar de instância ao escolher um item da lista, não ao digitar
+        if self.loading or self.combo_instance.get_active() == -1:
+            return
+        self.load_instance(self.current_instance())
+
+    def on_remove_instance(self, widget):
+        name = self.current_instance()
+        section = instance_section(name)
+        if name in self.desklets:
+            self.host.stop(name)
+        elif self.registry.is_running(name):
+            self.stop_external(name)
+        if section in self.config:
+            self.config.remove_section(section)
+            write_config_atomic(self.config, self.config_file)
+            logging.debug(f"Removed instance {name}")
+        self.update_autostart_entry()
+        self.load_settings()
 
     def save_settings(self):
-        logging.debug("Saving settings")
-        # Salvar configurações atuais
-        self.config["Desklet"] = {
+        name = self.current_instance()
+        section = instance_section(name)
+        logging.debug(f"Saving settings for instance {name}")
+        # Salvar configurações atuais, preservando chaves editadas apenas no INI
+        settings = dict(self.config[section]) if section in self.config else self.default_settings()
+        settings.update({
             "gif_path": self.entry_path.get_text(),
             "monitor": str(self.spin_monitor.get_value_as_int()),
             "position": self.combo_position.get_active_text(),
             "margin": str(self.spin_margin.get_value_as_int()),
             "autostart": str(self.check_autostart.get_active()),
-            "custom_x": self.config["Desklet"].get("custom_x", "0"),
-            "custom_y": self.config["Desklet"].get("custom_y", "0")
-        }
-        with open(self.config_file, "w") as f:
-            self.config.write(f)
-        logging.debug(f"Saved settings: {self.config['Desklet']}")
+            "speed": str(round(self.spin_speed.get_value(), 2)),
+            "max_fps": str(self.spin_max_fps.get_value_as_int()),
+            "loops": self.combo_loops.get_child().get_text().strip() or "forever",
+            "custom_x": settings.get("custom_x", "0"),
+            "custom_y": settings.get("custom_y", "0")
+        })
+        is_new = section not in self.config
+        self.config[section] = settings
+        write_config_atomic(self.config, self.config_file)
+        if is_new:
+            self.loading = True
+            self.combo_instance.append_text(name)
+            self.loading = False
+        logging.debug(f"Saved settings: {self.config[section]}")
 
     def check_running_instance(self):
-        if os.path.exists(self.lock_file):
-            try:
-                with open(self.lock_file, "r") as f:
-                    pid = f.read().strip()
-                pid = int(pid)
-                if psutil.pid_exists(pid):
-                    logging.debug(f"Found running instance with PID {pid}")
-                    self.btn_start.set_sensitive(False)
-                    self.btn_stop.set_sensitive(True)
-                    self.running_pid = pid
-                    self.has_desklet = True
-                else:
-                    logging.debug(f"Lock file exists but PID {pid} is not running, removing lock file")
-                    os.remove(self.lock_file)
-            except Exception as e:
-                logging.error(f"Error checking lock file {self.lock_file}: {e}")
-                if os.path.exists(self.lock_file):
-                    os.remove(self.lock_file)
-        else:
-            logging.debug("No running instance found")
+        name = self.current_instance()
+        running = name in self.desklets or name in self.host.starting or self.registry.is_running(name)
+        logging.debug(f"Instance {name} is {'running' if running else 'not running'}")
+        # Com a instância rodando, o botão aplica as configurações sem reiniciá-la
+        self.btn_start.set_label("Apply Settings" if running else "Start Desklet")
+        self.btn_stop.set_sensitive(running)
 
     def on_autostart_toggled(self, widget):
-        autostart_enabled = self.check_autostart.get_active()
+        if self.loading:
+            return
+        logging.debug(f"Autostart toggled: {self.check_autostart.get_active()}")
+        # Salvar configuração de autostart
+        self.save_settings()
+        self.update_autostart_entry()
+
+    def update_autostart_entry(self):
+        # Um único .desktop inicia todas as instâncias com autostart ativo
+        autostart_enabled = any(self.config[instance_section(name)].get("autostart", "False").lower() == "true"
+                                for name in instance_names(self.config))
         autostart_dir = os.path.expanduser("~/.config/autostart")
         autostart_file = os.path.join(autostart_dir, "gif-desklet.desktop")
 
-        logging.debug(f"Autostart toggled: {autostart_enabled}")
         if autostart_enabled:
             # Criar arquivo .desktop para autostart
             pathlib.Path(autostart_dir).mkdir(parents=True, exist_ok=True)
@@ -384,12 +3648,9 @@ X-GNOME-Autostart-enabled=true
                 except Exception as e:
                     logging.error(f"Failed to remove .desktop file: {e}")
 
-        # Salvar configuração de autostart
-        self.save_settings()
-
     def on_browse(self, widget):
         dialog = Gtk.FileChooserDialog(
-            title="Select GIF file",
+            title="Select animation",
             parent=self,
             action=Gtk.FileChooserAction.OPEN,
         )
@@ -398,16 +3659,30 @@ X-GNOME-Autostart-enabled=true
             Gtk.STOCK_OPEN, Gtk.ResponseType.OK,
         )
 
-        filter_gif = Gtk.FileFilter()
-        filter_gif.set_name("GIF files")
-        filter_gif.add_pattern("*.gif")
-        dialog.add_filter(filter_gif)
+        # Um filtro com todos os formatos suportados e um por decodificador
+        filter_all = Gtk.FileFilter()
+        filter_all.set_name("Animations")
+        dialog.add_filter(filter_all)
+        for cls in DECODERS:
+            filter_format = Gtk.FileFilter()
+            filter_format.set_name(f"{cls.name.upper()} files")
+            for extension in cls.extensions:
+                for f in (filter_all, filter_format):
+                    f.add_pattern(f"*{extension}")
+                    f.add_pattern(f"*{extension.upper()}")
+            dialog.add_filter(filter_format)
+        # Pacotes gerados por --render-only --pack
+        filter_pack = Gtk.FileFilter()
+        filter_pack.set_name("Frame packs")
+        filter_pack.add_pattern("*.frames")
+        filter_all.add_pattern("*.frames")
+        dialog.add_filter(filter_pack)
 
         response = dialog.run()
         if response == Gtk.ResponseType.OK:
             self.gif_path = dialog.get_filename()
             self.entry_path.set_text(self.gif_path)
-            logging.debug(f"Selected GIF path: {self.gif_path}")
+            logging.debug(f"Selected animation path: {self.gif_path}")
 
         dialog.destroy()
 
@@ -417,78 +3692,83 @@ X-GNOME-Autostart-enabled=true
             logging.error("Invalid GIF path provided")
             return
 
-        if self.desklet:
-            self.desklet.destroy()
-            self.desklet = None
-
-        gif_path = self.entry_path.get_text()
-        monitor_index = self.spin_monitor.get_value_as_int()
-        position = self.combo_position.get_active_text()
-        margin = self.spin_margin.get_value_as_int()
-
-        # Verificar se há uma instância em execução
-        if os.path.exists(self.lock_file):
-            self.show_error("Another instance is already running. Please stop it first.")
-            logging.error("Attempted to start Desklet while another instance is running")
+        name = self.current_instance()
+        if not valid_instance_name(name):
+            self.show_error("Instance names may only contain letters, digits, '-' and '_'.")
+            logging.error(f"Invalid instance name {name!r}")
             return
 
         # Salvar configurações antes de iniciar o desklet
         self.save_settings()
 
+        if name in self.host.starting:
+            logging.debug(f"Desklet {name} is still starting")
+            return
+        # Instância em execução: aplicar as configurações no lugar
+        if name in self.desklets:
+            self.desklets[name].reconfigure(self.config[instance_section(name)])
+            logging.debug(f"Applied settings to running Desklet {name}")
+            return
+        if self.registry.is_running(name):
+            try:
+                reply = self.registry.request(name, "reload")
+            except (OSError, ValueError) as e:
+                reply = {"error": str(e)}
+            if "error" in reply:
+                self.show_error(f"Failed to apply settings: {reply['error']}")
+                logging.error(f"Failed to reload instance {name}: {reply['error']}")
+            return
+
         try:
-            # Validar custom_x e custom_y
-            custom_x = None
-            custom_y = None
-            if position == "custom":
-                try:
-                    custom_x = int(self.config["Desklet"].get("custom_x", "0"))
-                    custom_y = int(self.config["Desklet"].get("custom_y", "0"))
-                    # Garantir que as coordenadas sejam válidas
-                    screen = Gdk.Screen.get_default()
-                    monitor_geom = screen.get_monitor_geometry(monitor_index)
-                    w, h = Image.open(gif_path).size
-                    custom_x = max(monitor_geom.x, min(custom_x, monitor_geom.x + monitor_geom.width - w))
-                    custom_y = max(monitor_geom.y, min(custom_y, monitor_geom.y + monitor_geom.height - h))
-                    logging.debug(f"Validated custom position: custom_x={custom_x}, custom_y={custom_y} for monitor {monitor_index}")
-                except (ValueError, TypeError) as e:
-                    logging.warning(f"Invalid custom_x or custom_y, using default: {e}")
-                    custom_x = monitor_geom.x
-                    custom_y = monitor_geom.y
-            self.desklet = GifDesklet(gif_path, monitor_index, position, margin, self.lock_file, custom_x, custom_y)
-            self.has_desklet = True
-            self.btn_start.set_sensitive(False)
-            self.btn_stop.set_sensitive(True)
-            logging.debug("Desklet started successfully")
+            on_progress = lambda decoded, total: self.on_decode_progress(name, decoded, total)
+            on_error = lambda message: self.on_decode_error(name, message)
+            create_desklet(name, self.config[instance_section(name)], self.host, on_progress, on_error)
+            self.check_running_instance()
+            logging.debug(f"Desklet {name} started successfully")
         except Exception as e:
             self.show_error(f"Failed to start Desklet: {str(e)}")
-            logging.error(f"Failed to start Desklet: {e}")
+            logging.error(f"Failed to start Desklet {name}: {e}")
 
     def on_stop(self, widget):
-        if self.desklet:
-            self.desklet.destroy()
-            self.desklet = None
-            self.has_desklet = False
-            logging.debug("Desklet stopped")
-        elif hasattr(self, "running_pid") and psutil.pid_exists(self.running_pid):
-            try:
-                process = psutil.Process(self.running_pid)
-                logging.debug(f"Attempting to terminate Desklet with PID {self.running_pid}")
-                process.terminate()
-                try:
-                    process.wait(timeout=1)
-                    logging.debug(f"Terminated running Desklet with PID {self.running_pid}")
-                except psutil.TimeoutExpired:
-                    time.sleep(0.5)  # Wait briefly and retry
-                    if not psutil.pid_exists(self.running_pid):
-                        logging.debug(f"Desklet with PID {self.running_pid} terminated after retry")
-                    else:
-                        logging.warning(f"Timeout waiting for Desklet with PID {self.running_pid} to terminate after retry")
-                self.has_desklet = False
-            except Exception as e:
-                logging.error(f"Failed to terminate running Desklet with PID {self.running_pid}: {e}")
-                self.show_error(f"Failed to stop running Desklet: {str(e)}")
-        self.btn_start.set_sensitive(True)
-        self.btn_stop.set_sensitive(False)
+        name = self.current_instance()
+        if name in self.desklets or name in self.host.starting:
+            self.host.stop(name)
+            logging.debug(f"Desklet {name} stopped")
+        else:
+            self.stop_external(name)
+        self.check_running_instance()
+
+    def stop_external(self, name):
+        # A instância roda em outro processo: pedir pelo socket de controle,
+        # que só responde depois de fechá-la. As demais instâncias do processo
+        # continuam rodando
+        try:
+            reply = self.registry.request(name, "stop")
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to stop instance {name}: {e}")
+            self.show_error(f"Failed to stop running Desklet: {str(e)}")
+            return
+        if "error" in reply:
+            logging.error(f"Instance {name} refused to stop: {reply['error']}")
+            self.show_error(f"Failed to stop running Desklet: {reply['error']}")
+        else:
+            logging.debug(f"Stopped instance {name} running in another process")
+
+    def on_decode_progress(self, name, decoded, total):
+        if name != self.current_instance():
+            return False
+        if decoded >= total:
+            self.progress.hide()
+        else:
+            self.progress.set_fraction(decoded / total)
+            self.progress.set_text(f"Decoding {name}: {decoded}/{total} frames")
+            self.progress.show()
+        return False
+
+    def on_decode_error(self, name, message):
+        self.progress.hide()
+        self.check_running_instance()
+        self.show_error(f"Failed to decode the animation of {name}: {message}")
 
     def show_error(self, msg):
         dialog = Gtk.MessageDialog(
@@ -503,69 +3783,312 @@ X-GNOME-Autostart-enabled=true
 
     def on_destroy(self, widget):
         logging.debug("Controller window destroyed")
-        if not self.has_desklet:
+        if not self.desklets:
             logging.debug("No active Desklet, quitting main loop")
             Gtk.main_quit()
+        else:
+            # Os desklets continuam; o processo termina quando o último fechar
+            self.host.quit_when_empty = True
+
+# Casos do benchmark: (nome, largura, altura, frames, descarte)
+BENCHMARK_CASES = [
+    ("small", 128, 128, 24, 1),
+    ("medium", 480, 360, 60, 1),
+    ("medium-restore-background", 480, 360, 60, 2),
+    ("medium-restore-previous", 480, 360, 60, 3),
+    ("large", 800, 600, 120, 1),
+]
+QUICK_BENCHMARK_CASES = ["small", "medium-restore-background"]
+
+def make_synthetic_gif(path, width, height, frame_count, disposal, duration=40):
+    # Fundo estático em degradê com um quadrado se movendo: como na maioria dos
+    # GIFs de desklet, cada frame muda só uma pequena região
+    background = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    side = max(8, min(width, height) // 6)
+    frames = []
+    for i in range(frame_count):
+        frame = background.copy()
+        x = (i * max(1, (width - side) // max(1, frame_count - 1))) % max(1, width - side)
+        y = (height - side) // 2
+        frame.paste((255, 64 + (i * 7) % 192, 32), (x, y, x + side, y + side))
+        frames.append(frame)
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=duration, loop=0, disposal=disposal)
+
+def current_rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def benchmark_case(path, ticks):
+    result = {}
+    rss_before = current_rss()
+
+    # Tempo até o primeiro frame: abrir, decodificar o frame 0 e convertê-lo em pixbuf
+    start = time.perf_counter()
+    frames = FrameSource(path)
+    pixbufs = PixbufCache(frames)
+    pixbufs.get(0)
+    result["time_to_first_frame_ms"] = (time.perf_counter() - start) * 1000
+
+    # Decodificação e conversão de cada frame, medidas em tempo de CPU
+    decode_cpu = []
+    pixbuf_cpu = []
+    for index in range(frames.frame_count):
+        start = time.process_time()
+        frames.get_frame(index)
+        decode_cpu.append(time.process_time() - start)
+        start = time.process_time()
+        pixbufs.get(index)
+        pixbuf_cpu.append(time.process_time() - start)
+    result["frames"] = frames.frame_count
+    result["decode_cpu_ms_per_frame"] = statistics.mean(decode_cpu) * 1000
+    result["pixbuf_cpu_ms_per_frame"] = statistics.mean(pixbuf_cpu) * 1000
+
+    # Desenho no modo delta sobre uma superfície fora da tela
+    w, h = frames.size
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+    paint_cpu = []
+    painted = 0
+    for index in range(frames.frame_count):
+        rect = frames.get_dirty_rect(index) if index else None
+        rect = rect or (0, 0, w, h)
+        start = time.process_time()
+        if rect[2] and rect[3]:
+            paint_region(surface, pixbufs.get(index), rect)
+        paint_cpu.append(time.process_time() - start)
+        painted += rect[2] * rect[3]
+    result["delta_paint_cpu_ms_per_frame"] = statistics.mean(paint_cpu) * 1000
+    result["delta_area_ratio"] = painted / (w * h * frames.frame_count)
+
+    # Precisão do agendador: atraso de cada frame em relação ao seu prazo
+    scheduler = AnimationScheduler()
+    loop = GLib.MainLoop()
+    lateness = []
+
+    def render(index):
+        # O primeiro render vem de start(), ainda sem prazo a cumprir
+        if animation.deadline is None:
+            return
+        lateness.append(animation.last_lateness)
+        if len(lateness) >= ticks:
+            animation.stop()
+            loop.quit()
+
+    animation = Animation(frames, render, scheduler)
+    start_cpu = time.process_time()
+    animation.start()
+    loop.run()
+    result["schedule_cpu_ms_per_frame"] = (time.process_time() - start_cpu) * 1000 / max(1, len(lateness))
+    result["jitter_ms_mean"] = statistics.mean(lateness) * 1000
+    result["jitter_ms_p95"] = sorted(lateness)[int(len(lateness) * 0.95) - 1] * 1000 if lateness else 0.0
+    result["jitter_ms_max"] = max(lateness) * 1000
+    result["skipped_frames"] = animation.skipped
+
+    result["frame_memory_bytes"] = frames.memory_usage() + pixbufs.bytes_used
+    result["rss_delta_bytes"] = current_rss() - rss_before
+    pixbufs.clear()
+    frames.close()
+    return result
+
+def run_benchmarks(output=None, quick=False):
+    # Roda sem display: só PIL, GdkPixbuf, cairo e o loop do GLib
+    cases = [case for case in BENCHMARK_CASES if not quick or case[0] in QUICK_BENCHMARK_CASES]
+    ticks = 10 if quick else 50
+    report = {"python": sys.version.split()[0], "numpy": numpy is not None, "cases": []}
+    with tempfile.TemporaryDirectory(prefix="gif_desklet_bench_") as tmp_dir:
+        for name, width, height, frame_count, disposal in cases:
+            path = os.path.join(tmp_dir, f"{name}.gif")
+            make_synthetic_gif(path, width, height, frame_count, disposal)
+            result = {"name": name, "width": width, "height": height, "disposal": disposal}
+            result.update(benchmark_case(path, ticks))
+            report["cases"].append(result)
+    # ru_maxrss vem em KB no Linux
+    report["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+def render_only(path, scaling, output=None, pack=None, ticks=0):
+    # O pipeline de frames sem janela: decodificação, composição, escala e
+    # agendamento, desenhando em uma superfície cairo fora da tela como o
+    # modo delta faz na tela. Os hashes dos frames são determinísticos; os
+    # tempos servem de traço de desempenho
+    frames = FrameSource(path, frames_ahead=1, scaling=scaling)
+    pixbufs = PixbufCache(frames)
+    w, h = frames.size
+    full = (0, 0, w, h)
+    sink = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+    reference = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+    report = {
+        "path": path, "decoder": frames.decoder_name, "scaling": scaling.key(), "width": w, "height": h,
+        "frame_count": frames.frame_count, "loop_count": frames.loop_count, "plays": frames.plays,
+        "frames": [],
+    }
+
+    # Primeira passada: cada frame decodificado, convertido e desenhado uma vez
+    mismatched = 0
+    for index in range(frames.frame_count):
+        start = time.perf_counter()
+        data = frames.get_frame(index)
+        decode_ms = (time.perf_counter() - start) * 1000
+        rect = frames.get_dirty_rect(index) if index else None
+        start = time.perf_counter()
+        pb = pixbufs.get(index)
+        if (rect or full)[2] and (rect or full)[3]:
+            paint_region(sink, pb, rect or full)
+        paint_ms = (time.perf_counter() - start) * 1000
+        # A superfície desenhada só pela região alterada deve ser igual ao frame inteiro
+        paint_region(reference, pb, full)
+        matches = bytes(sink.get_data()) == bytes(reference.get_data())
+        mismatched += not matches
+        report["frames"].append({
+            "index": index,
+            "duration_ms": frames.get_duration(index),
+            "dirty_rect": list(rect) if rect else None,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "delta_matches": matches,
+            "decode_ms": round(decode_ms, 3),
+            "paint_ms": round(paint_ms, 3),
+        })
+
+    # Reprodução pelo agendador real, pelo número pedido de frames (padrão: um loop)
+    scheduler = AnimationScheduler()
+    loop = GLib.MainLoop()
+    trace = []
+    ticks = ticks or frames.frame_count
+
+    def render(index):
+        paint_region(sink, pixbufs.get(index), full)
+        # O primeiro render vem de start(), ainda sem prazo a cumprir
+        if animation.deadline is None:
+            return
+        trace.append({"index": index, "lateness_ms": round(animation.last_lateness * 1000, 3)})
+        if len(trace) >= ticks:
+            animation.stop()
+            loop.quit()
+
+    animation = Animation(frames, render, scheduler)
+    if frames.frame_count > 1:
+        animation.start()
+        loop.run()
+    report["trace"] = trace
+    report["skipped_frames"] = animation.skipped
+    report["delta_mismatches"] = mismatched
+    pixbufs.clear()
+    frames.close()
+
+    ok = mismatched == 0
+    if pack:
+        # O mesmo formato do cache em disco, que o desklet mapeia sem decodificar
+        ok = DiskFrameCache().build(path, scaling, pack) and ok
+        report["pack"] = pack
+    report["ok"] = ok
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Display a GIF as a desktop widget.")
+    parser.add_argument("--autostart", action="store_true",
+                        help="start the desklets configured for autostart, without the controller window")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="run the headless benchmark suite and print a JSON report")
+    parser.add_argument("--quick", action="store_true", help="run a reduced benchmark suite")
+    parser.add_argument("--render-only", metavar="PATH",
+                        help="run the frame pipeline for PATH without a window and print frame hashes and timings as JSON")
+    parser.add_argument("--pack", metavar="FILE",
+                        help="with --render-only, also write a frame pack that a desklet can load in place of the GIF")
+    parser.add_argument("--ticks", type=int, default=0,
+                        help="with --render-only, number of scheduled frames to trace (default: one loop)")
+    parser.add_argument("--scale", type=float, default=1.0, help="with --render-only, scale factor")
+    parser.add_argument("--width", type=int, default=0, help="with --render-only, target width in pixels")
+    parser.add_argument("--height", type=int, default=0, help="with --render-only, target height in pixels")
+    parser.add_argument("--stats", nargs="?", const="", metavar="NAME",
+                        help="print the live counters of the running desklets (or only of instance NAME) as JSON")
+    parser.add_argument("--status", nargs="?", const="", metavar="NAME",
+                        help="print the status of the running desklets (or only of instance NAME) as JSON")
+    parser.add_argument("--start", metavar="NAME",
+                        help="start instance NAME, in the process already hosting desklets if there is one")
+    parser.add_argument("--stop", metavar="NAME", help="stop the running instance NAME")
+    parser.add_argument("--reload", metavar="NAME", help="apply the current config file to the running instance NAME in place")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print import time and time to the first painted frame of each desklet as JSON")
+    parser.add_argument("--log-level", choices=LOG_LEVELS,
+                        help="log level, overriding log_level from the [General] section")
+    parser.add_argument("--output",
+                        help="write the benchmark, render, stats, status or startup report to this file instead of stdout")
+    return parser.parse_args(argv)
 
 def main():
+    global _startup_report
+    args = parse_args()
+    settings = general_settings()
+    setup_logging(args.log_level or settings.get("log_level", DEFAULT_LOG_LEVEL).lower(),
+                  int_setting(settings, "log_max_kb", DEFAULT_LOG_MAX_KB),
+                  int_setting(settings, "log_backups", DEFAULT_LOG_BACKUPS))
     logging.debug("Starting main function")
+    if args.startup_report:
+        _startup_report = StartupReport(args.output)
+        _startup_report.mark("main_ms")
+    if args.benchmark:
+        run_benchmarks(args.output, args.quick)
+        return
+    if args.render_only:
+        report = render_only(args.render_only, FrameScaling(args.scale, args.width, args.height),
+                             args.output, args.pack, args.ticks)
+        sys.exit(0 if report["ok"] else 1)
+    # Comandos para as instâncias em execução, pelos sockets de controle
+    if args.stats is not None:
+        instance_command("stats", args.stats or None, args.output)
+        return
+    if args.status is not None:
+        instance_command("status", args.status or None, args.output)
+        return
+    if args.stop:
+        instance_command("stop", args.stop)
+        return
+    if args.reload:
+        instance_command("reload", args.reload)
+        return
+    if args.start:
+        start_instance(args.start)
+        return
+
     # Verificar se foi chamado com --autostart
-    if "--autostart" in sys.argv:
+    if args.autostart:
         logging.debug("Autostart mode activated")
-        config_dir = os.path.expanduser("~/.gif_desklet")
-        config_file = os.path.join(config_dir, "gif_desklet.ini")
-        lock_file = os.path.join(config_dir, "gif_desklet.lock")
         config = configparser.ConfigParser()
         try:
-            if os.path.exists(config_file):
-                config.read(config_file)
-                settings = config["Desklet"]
-                gif_path = settings.get("gif_path", "")
-                if gif_path and os.path.isfile(gif_path):
-                    # Verificar se há uma instância em execução
-                    if os.path.exists(lock_file):
-                        try:
-                            with open(lock_file, "r") as f:
-                                pid = f.read().strip()
-                            pid = int(pid)
-                            if psutil.pid_exists(pid):
-                                logging.debug(f"Autostart aborted: instance with PID {pid} is running")
-                                return
-                            else:
-                                logging.debug(f"Lock file exists but PID {pid} is not running, removing lock file")
-                                os.remove(lock_file)
-                        except Exception as e:
-                            logging.error(f"Error checking lock file {lock_file}: {e}")
-                            if os.path.exists(lock_file):
-                                os.remove(lock_file)
-                    monitor_index = int(settings.get("monitor", "0"))
-                    position = settings.get("position", "bottom-right")
-                    margin = int(settings.get("margin", "20"))
-                    custom_x = None
-                    custom_y = None
-                    if position == "custom":
-                        try:
-                            custom_x = int(settings.get("custom_x", "0"))
-                            custom_y = int(settings.get("custom_y", "0"))
-                            # Validar coordenadas
-                            screen = Gdk.Screen.get_default()
-                            monitor_geom = screen.get_monitor_geometry(monitor_index)
-                            w, h = Image.open(gif_path).size
-                            custom_x = max(monitor_geom.x, min(custom_x, monitor_geom.x + monitor_geom.width - w))
-                            custom_y = max(monitor_geom.y, min(custom_y, monitor_geom.y + monitor_geom.height - h))
-                            logging.debug(f"Validated custom position for autostart: custom_x={custom_x}, custom_y={custom_y} for monitor {monitor_index}")
-                        except (ValueError, TypeError) as e:
-                            logging.warning(f"Invalid custom_x or custom_y in autostart, using default: {e}")
-                            custom_x = monitor_geom.x
-                            custom_y = monitor_geom.y
-                    logging.debug(f"Autostart settings: gif_path={gif_path}, monitor={monitor_index}, position={position}, margin={margin}, custom_x={custom_x}, custom_y={custom_y}")
-                    desklet = GifDesklet(gif_path, monitor_index, position, margin, lock_file, custom_x, custom_y)
-                    Gtk.main()
-                    return
-                else:
-                    logging.error(f"Invalid or missing GIF path: {gif_path}")
-            else:
-                logging.error(f"Config file not found: {config_file}")
+            if not os.path.exists(CONFIG_FILE):
+                logging.error(f"Config file not found: {CONFIG_FILE}")
+                return
+            config.read(CONFIG_FILE)
+            host = get_host()
+            for name in instance_names(config):
+                settings = config[instance_section(name)]
+                if settings.get("autostart", "False").lower() != "true":
+                    continue
+                # Verificar se há uma instância em execução
+                if host.registry.is_running(name):
+                    logging.debug(f"Autostart of instance {name} skipped: already running")
+                    continue
+                try:
+                    host.start(name)
+                except Exception as e:
+                    logging.error(f"Autostart of instance {name} failed: {e}")
+            if host.desklets or host.starting:
+                host.quit_when_empty = True
+                Gtk.main()
+            host.shutdown()
         except Exception as e:
             logging.error(f"Autostart failed: {e}")
         return
@@ -576,6 +4099,7 @@ def main():
     win.connect("destroy", win.on_destroy)
     win.show_all()
     Gtk.main()
+    get_host().shutdown()
 
 if __name__ == "__main__":
     main()
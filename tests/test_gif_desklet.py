@@ -0,0 +1,692 @@
+import concurrent.futures
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+pytest.importorskip("gi")
+Image = pytest.importorskip("PIL.Image")
+features = pytest.importorskip("PIL.features")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gif_desklet as gd
+
+
+class StubDecoder(gd.FrameDecoder):
+    # Um quadrado vermelho de 3x3 que anda um pixel por frame sobre fundo
+    # transparente; fail_at faz read() falhar nesse frame
+    name = "stub"
+    instances = []
+
+    def __init__(self, path, frame_count=6, fail_at=None):
+        super().__init__(path)
+        self.size = (32, 8)
+        self.frame_count = frame_count
+        self.loop_count = 0
+        self.fail_at = fail_at
+        self.closed = 0
+        StubDecoder.instances.append(self)
+
+    def read(self, index, palettes=None):
+        if index == self.fail_at:
+            raise ValueError(f"broken frame {index}")
+        image = Image.new("RGBA", self.size, (0, 0, 0, 0))
+        image.paste((255, 0, 0, 255), (index, 2, index + 3, 5))
+        return 40, None, image, None
+
+    def close(self):
+        self.closed += 1
+
+
+class InlinePool:
+    # Executa cada tarefa na hora: o future já está pronto quando submit() volta
+    def __init__(self, isolated=False):
+        self.mode = "process" if isolated else "thread"
+        self.isolated = isolated
+
+    def submit(self, fn, *args, affinity=None):
+        future = concurrent.futures.Future()
+        self.run(future, fn, args)
+        return future
+
+    def forget(self, affinity):
+        pass
+
+    @staticmethod
+    def run(future, fn, args):
+        if future.cancelled():
+            return
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+
+class DeferredPool(InlinePool):
+    # Guarda as tarefas até drain(), como um worker ainda ocupado
+    def __init__(self, isolated=False):
+        super().__init__(isolated)
+        self.queue = []
+        self.affinities = []
+
+    def submit(self, fn, *args, affinity=None):
+        future = concurrent.futures.Future()
+        self.queue.append((future, fn, args))
+        self.affinities.append(affinity)
+        return future
+
+    def drain(self):
+        while self.queue:
+            self.run(*self.queue.pop(0))
+
+
+class FakeFrames:
+    def __init__(self, frame_count, durations=None, hidden=()):
+        self.frame_count = frame_count
+        self.durations = durations or [100] * frame_count
+        self.hidden = set(hidden)
+
+    def get_duration(self, index):
+        return self.durations[index]
+
+    def is_visible(self, index):
+        return index not in self.hidden
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.animations = set()
+
+    def add(self, animation):
+        self.animations.add(animation)
+
+    def remove(self, animation):
+        self.animations.discard(animation)
+
+
+class FakeHost:
+    # O que um GifDesklet usa do DeskletHost, sem sockets de controle
+    def __init__(self, pool=None):
+        self.scheduler = FakeScheduler()
+        self.frame_store = gd.FrameStore(pool)
+        self.desklets = {}
+        self.starting = set()
+
+    def add(self, desklet):
+        self.desklets[desklet.name] = desklet
+
+    def remove(self, desklet):
+        if self.desklets.get(desklet.name) is desklet:
+            del self.desklets[desklet.name]
+
+    def quit_if_empty(self):
+        pass
+
+
+class FakeMonitors:
+    def __init__(self, scale=1):
+        self.scale = scale
+        self.callbacks = []
+
+    def connect(self, callback):
+        self.callbacks.append(callback)
+
+    def disconnect(self, callback):
+        self.callbacks.remove(callback)
+
+    def geometry(self, index):
+        return gd.MonitorInfo(0, 0, 1920, 1080, self.scale)
+
+    def scale_factor(self, index):
+        return self.scale
+
+
+def require_display():
+    if gd.Gdk.Display.get_default() is None:
+        pytest.skip("needs a display")
+
+
+def new_desklet(host, path, **options):
+    require_display()
+    return gd.GifDesklet(path, 0, "top-left", 0, name="test", host=host, disk_cache_mb=0,
+                         system_state=gd.StaticSystemState(), **options)
+
+
+@pytest.fixture(autouse=True)
+def isolated_module(monkeypatch):
+    # Sem loop do GTK: callbacks agendados rodam na hora
+    monkeypatch.setattr(gd.GLib, "idle_add", lambda callback, *args: callback(*args))
+    monkeypatch.setattr(gd, "_worker_images", {})
+    StubDecoder.instances = []
+
+
+@pytest.fixture
+def animation(tmp_path, monkeypatch):
+    # Cria um arquivo qualquer e faz open_decoder() devolver o StubDecoder para ele
+    options = {}
+
+    def make(frame_count=6, fail_at=None):
+        path = str(tmp_path / f"anim{len(options)}.stub")
+        with open(path, "wb") as f:
+            f.write(b"STUB")
+        options[os.path.realpath(path)] = (frame_count, fail_at)
+        return path
+
+    monkeypatch.setattr(gd, "open_decoder", lambda path: StubDecoder(path, *options[os.path.realpath(path)]))
+    return make
+
+
+def square_rect(index, frame_count):
+    # Região alterada esperada: o quadrado anterior somado ao atual
+    previous = (index - 1) % frame_count
+    x0, x1 = min(previous, index), max(previous, index) + 3
+    return (x0, 2, x1 - x0, 3)
+
+
+def test_clamp_frame_delay():
+    assert gd.clamp_frame_delay(None) == 100
+    assert gd.clamp_frame_delay(0) == 100
+    assert gd.clamp_frame_delay(10) == 100
+    assert gd.clamp_frame_delay(11) == 11
+    assert gd.clamp_frame_delay(250) == 250
+
+
+def test_frame_visibility_without_limit_shows_everything():
+    visibility = gd.FrameVisibility(3)
+    visibility.update([None, None, None])
+    assert all(visibility.is_visible(i) for i in range(3))
+
+
+def test_frame_visibility_merges_short_frames():
+    visibility = gd.FrameVisibility(5, min_interval_ms=50)
+    durations = [20, 20, 20, None, None]
+    visibility.update(durations)
+    assert [visibility.is_visible(i) for i in range(4)] == [True, False, False, True]
+    # Duração do frame 3 ainda desconhecida: o frame 4 conta como visível
+    assert visibility.is_visible(4)
+    durations[3] = 30
+    visibility.update(durations)
+    assert not visibility.is_visible(4)
+
+
+def test_animation_advances_and_counts_loops():
+    rendered = []
+    scheduler = FakeScheduler()
+    animation = gd.Animation(FakeFrames(3), rendered.append, scheduler, loops=2)
+    animation.start()
+    assert rendered == [0] and animation in scheduler.animations
+
+    for _ in range(5):
+        animation.advance(animation.deadline)
+    assert rendered == [0, 1, 2, 0, 1, 2]
+    assert animation.loops_done == 1
+
+    # A segunda volta termina no último frame, sem redesenhá-lo
+    animation.advance(animation.deadline)
+    assert animation.finished and animation.loops_done == 2
+    assert animation.frame_index == 2 and rendered[-1] == 2
+    assert animation not in scheduler.animations
+
+
+def test_animation_skips_late_frames():
+    rendered = []
+    animation = gd.Animation(FakeFrames(3), rendered.append, FakeScheduler())
+    animation.start()
+    deadline = animation.deadline
+    animation.advance(deadline + 0.25)
+    assert animation.skipped == 2
+    assert animation.loops_done == 1
+    assert rendered == [0, 0]
+    assert animation.deadline == pytest.approx(deadline + 0.3)
+
+
+def test_animation_holds_hidden_frames_on_screen():
+    rendered = []
+    animation = gd.Animation(FakeFrames(3, hidden={1}), rendered.append, FakeScheduler())
+    animation.start()
+    deadline = animation.deadline
+    animation.advance(deadline)
+    assert rendered == [0, 2]
+    assert animation.deadline == pytest.approx(deadline + 0.1)
+    assert animation._span(0) == pytest.approx(0.2)
+
+
+def test_single_frame_animation_is_not_scheduled():
+    rendered = []
+    scheduler = FakeScheduler()
+    animation = gd.Animation(FakeFrames(1), rendered.append, scheduler)
+    animation.start()
+    animation.pause()
+    animation.resume()
+    assert rendered == [0]
+    assert not scheduler.animations
+
+
+def test_memory_budget_disabled_keeps_every_frame():
+    plan = gd.MemoryBudget(0).plan((100, 100), 10, gd.FrameScaling(), 0, 64, 64, 16)
+    assert plan.strategy == "full"
+    assert plan.pixbuf_bytes == 100 * 100 * 4 * 10
+
+
+def test_memory_budget_streams_large_animations():
+    budget = gd.MemoryBudget(64)
+    plan = budget.plan((1000, 1000), 100, gd.FrameScaling(), 0, 64, 256, 0)
+    assert plan.strategy == "window"
+    assert plan.reserved_bytes <= 64 * 1024 * 1024
+
+
+def test_memory_budget_skips_then_downscales():
+    budget = gd.MemoryBudget(8)
+    skip = budget.plan((1000, 1000), 100, gd.FrameScaling(), 0, 64, 256, 0)
+    assert skip.strategy == "skip"
+    assert skip.min_interval_ms == gd.MemoryBudget.SKIP_INTERVAL_MS
+
+    downscale = budget.plan((2000, 2000), 100, gd.FrameScaling(), 0, 64, 256, 0)
+    assert downscale.strategy == "downscale"
+    width, height = downscale.scaling.output_size((2000, 2000))
+    assert width < 2000 and height < 2000
+    assert downscale.frame_bytes <= 4 * 1024 * 1024
+
+
+def test_memory_budget_counts_reservations():
+    mb = 1024 * 1024
+    budget = gd.MemoryBudget(64)
+    first = budget.plan((1000, 1000), 10, gd.FrameScaling(), 0, 0, 40, 0)
+    assert first.strategy == "full"
+    budget.reserve("a", first)
+    # O que sobrou do orçamento é dividido entre a janela e os pixbufs
+    second = budget.plan((1000, 1000), 10, gd.FrameScaling(), 0, 0, 40, 0)
+    assert second.strategy == "window"
+    assert second.pixbuf_bytes == (64 * mb - first.reserved_bytes) // 2
+    budget.release("a")
+    assert budget.available() == 64 * 1024 * 1024
+
+
+def test_frame_store_shares_and_closes_once(animation):
+    path = animation()
+    store = gd.FrameStore()
+    key, frames, pixbufs = store.acquire(path, disk_cache_mb=0)
+    same_key, same_frames, _ = store.acquire(path, disk_cache_mb=0)
+    assert same_key == key and same_frames is frames
+    # Uma referência de fora ao decodificador compartilhado
+    image_key, entry = gd.acquire_shared_image(path)
+
+    pixbufs.clear()
+    assert not frames.closed
+    store.release(key)
+    assert not frames.closed
+    store.release(key)
+    assert frames.closed and key not in store.entries
+    # Fechado uma única vez, mesmo chamando close() de novo: a referência de
+    # fora continua válida
+    frames.close()
+    decoder = StubDecoder.instances[0]
+    assert entry[2] == 1 and not decoder.closed
+
+    gd.release_shared_image(image_key, entry, True)
+    assert decoder.closed == 1
+
+
+def test_frame_source_preload_with_finished_futures(animation):
+    # Futures que já terminaram quando _submit() registra o callback não podem travar
+    frames = gd.FrameSource(animation(frame_count=20))
+    done = threading.Event()
+    frames.when_complete(done.set)
+    worker = threading.Thread(target=frames.preload, args=(InlinePool(),), daemon=True)
+    worker.start()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert done.is_set()
+    assert frames.durations == [40] * 20
+    assert frames.dirty_rects[1:] == [square_rect(i, 20) for i in range(1, 20)]
+    # A região do frame 0 é relativa ao último frame do loop
+    assert frames.dirty_rects[0] == square_rect(0, 20)
+
+
+def test_process_mode_opens_no_decoder_and_waits_on_misses(animation):
+    path = animation(frame_count=10)
+    info = InlinePool(isolated=True).submit(gd.probe_animation, path).result()
+    frames = gd.FrameSource(path, frames_ahead=2, info=info)
+    assert frames.decoder is None and frames.loop_count == 0
+
+    pool = DeferredPool(isolated=True)
+    frames.preload(pool)
+    assert frames.get_frame(0) is None
+    assert frames.get_duration(0) is None
+    arrived = []
+    frames.when_ready(5, lambda: arrived.append(5))
+    assert not arrived
+
+    pool.drain()
+    assert arrived == [5]
+    assert frames.get_frame(0) is not None
+    # As regiões alteradas vêm dos workers
+    assert frames.dirty_rects == [square_rect(i, 10) for i in range(10)]
+    frames.close()
+
+
+def test_frame_store_probes_in_the_pool_in_process_mode(animation, monkeypatch):
+    path = animation()
+    probed = []
+    probe = gd.probe_animation
+    monkeypatch.setattr(gd, "probe_animation", lambda p: probed.append(p) or probe(p))
+    store = gd.FrameStore(InlinePool(isolated=True))
+    key, frames, _ = store.acquire(path, disk_cache_mb=0)
+    assert probed == [path]
+    assert frames.decoder is None
+    assert frames.durations == [40] * 6
+    store.release(key)
+
+
+def test_decode_failure_reaches_waiters(animation):
+    frames = gd.FrameSource(animation(frame_count=12, fail_at=9))
+    pool = DeferredPool()
+    frames.preload(pool)
+    ready = []
+    complete = []
+    frames.when_ready(10, lambda: ready.append(frames.error))
+    frames.when_complete(lambda: complete.append(frames.error))
+
+    pool.drain()
+    assert frames.error == "broken frame 9"
+    assert ready == complete == ["broken frame 9"]
+    # Depois da falha ninguém fica esperando
+    frames.when_ready(11, lambda: ready.append(None))
+    assert ready[-1] is None
+    frames.close()
+
+
+def test_shared_frames_keep_one_window_per_consumer(animation):
+    frames = gd.FrameSource(animation(frame_count=12), frames_ahead=6)
+    for step in range(4):
+        frames.get_frame(step, "a")
+        frames.get_frame(step + 6, "b")
+    assert sorted(frames.ring) == [3, 4, 5, 9, 10, 11]
+    decoded = frames.decode_count
+    frames.get_frame(3, "a")
+    frames.get_frame(9, "b")
+    assert frames.decode_count == decoded
+
+    frames.forget("b")
+    frames.get_frame(4, "a")
+    assert sorted(frames.ring) == list(range(4, 10))
+    frames.close()
+
+
+def test_disk_cache_frames_are_not_copied(animation, tmp_path):
+    path = animation()
+    scaling = gd.FrameScaling()
+    disk_cache = gd.DiskFrameCache(cache_dir=str(tmp_path / "cache"), max_mb=10)
+    assert disk_cache.build(path, scaling)
+    frames = disk_cache.load(path, scaling)
+    reference = gd.FrameSource(path)
+
+    frame = frames.get_frame(3)
+    assert isinstance(frame, memoryview)
+    assert bytes(frame) == reference.get_frame(3)
+    assert frames.dirty_rects[1:] == [square_rect(i, 6) for i in range(1, 6)]
+    # Uma fatia ainda em uso não impede o close()
+    frames.close()
+    assert bytes(frame[:4]) == bytes(4)
+    reference.close()
+
+
+def test_concurrent_disk_cache_builds_do_not_collide(animation, tmp_path, monkeypatch):
+    path = animation()
+    scaling = gd.FrameScaling()
+    cache_dir = tmp_path / "cache"
+    disk_cache = gd.DiskFrameCache(cache_dir=str(cache_dir), max_mb=10)
+    # As duas gravações ficam no meio do arquivo ao mesmo tempo
+    barrier = threading.Barrier(2, timeout=5)
+    read = StubDecoder.read
+
+    def read_together(self, index, palettes=None):
+        if index == 1:
+            barrier.wait()
+        return read(self, index, palettes)
+
+    monkeypatch.setattr(StubDecoder, "read", read_together)
+    results = []
+    builders = [threading.Thread(target=lambda: results.append(disk_cache.build(path, scaling))) for _ in range(2)]
+    for builder in builders:
+        builder.start()
+    for builder in builders:
+        builder.join(timeout=5)
+    assert results == [True, True]
+    assert os.listdir(cache_dir) == [os.path.basename(disk_cache.entry_path(path, scaling))]
+    frames = disk_cache.load(path, scaling)
+    assert frames.frame_count == 6
+    frames.close()
+    monkeypatch.setattr(StubDecoder, "read", read)
+
+    # Desklets que só diferem no limite de FPS pedem a mesma entrada uma vez só
+    pool = DeferredPool()
+    store = gd.FrameStore(pool)
+    store.build_disk_cache(disk_cache, path, scaling)
+    store.build_disk_cache(disk_cache, path, scaling)
+    assert len(pool.queue) == 1
+    pool.drain()
+    assert not store.building
+
+
+def test_disk_cache_evicts_least_recently_used_and_stale_entries(animation, tmp_path):
+    scaling = gd.FrameScaling()
+    disk_cache = gd.DiskFrameCache(cache_dir=str(tmp_path / "cache"), max_mb=10)
+    paths = [animation() for _ in range(4)]
+    entries = [disk_cache.entry_path(path, scaling) for path in paths]
+    for path in paths[:2]:
+        assert disk_cache.build(path, scaling)
+    entry_bytes = os.path.getsize(entries[0])
+    # A primeira entrada foi usada por último
+    os.utime(entries[1], ns=(10 ** 9, 10 ** 9))
+    frames = disk_cache.load(paths[0], scaling)
+    frames.close()
+
+    # Três entradas num teto de duas e meia: sai a usada há mais tempo
+    disk_cache.total_bytes = int(2.5 * entry_bytes)
+    assert disk_cache.build(paths[2], scaling)
+    assert [os.path.exists(entry) for entry in entries[:3]] == [True, False, True]
+
+    # Entradas de GIFs apagados ou alterados saem na próxima gravação
+    os.remove(paths[0])
+    with open(paths[2], "ab") as f:
+        f.write(b"changed")
+    assert disk_cache.build(paths[3], scaling)
+    assert sorted(os.listdir(tmp_path / "cache")) == [os.path.basename(entries[3])]
+
+
+def test_pixbuf_cache_reuses_hidpi_surfaces(monkeypatch):
+    class Pixbuf:
+        def __init__(self, data):
+            self.size = data.get_size()
+
+        def get_byte_length(self):
+            return self.size
+
+    class Bytes:
+        def __init__(self, data):
+            self.data = data
+
+        def get_size(self):
+            return len(self.data)
+
+    class Surface:
+        def set_device_scale(self, x, y):
+            surfaces.append((x, y))
+
+    surfaces = []
+    monkeypatch.setattr(gd, "GLib", types.SimpleNamespace(Bytes=types.SimpleNamespace(new=Bytes)))
+    monkeypatch.setattr(gd, "GdkPixbuf", types.SimpleNamespace(
+        Colorspace=types.SimpleNamespace(RGB=0),
+        Pixbuf=types.SimpleNamespace(new_from_bytes=lambda data, *args: Pixbuf(data))))
+    monkeypatch.setattr(gd, "Gdk", types.SimpleNamespace(
+        cairo_surface_create_from_pixbuf=lambda pb, scale, window: Surface()))
+
+    frame_bytes = 16 * 16 * 4
+    frames = types.SimpleNamespace(size=(16, 16), get_frame=lambda index, consumer=None: bytes(frame_bytes))
+    pixbufs = gd.PixbufCache(frames, 4 * frame_bytes / (1024 * 1024))
+    for _ in range(3):
+        pixbufs.get(0)
+        surface = pixbufs.get_surface(0, (2, 2))
+    assert surfaces == [(2, 2)]
+    assert pixbufs.get_surface(0, (2, 2)) is surface
+    assert pixbufs.bytes_used == 2 * frame_bytes
+
+    # O pixbuf e a superfície saem juntos do cache
+    for index in (1, 2):
+        pixbufs.get(index)
+        pixbufs.get_surface(index, (2, 2))
+    assert 0 not in pixbufs.pixbufs and 0 not in pixbufs.surfaces
+    assert pixbufs.bytes_used <= 4 * frame_bytes
+
+
+def test_desklet_closes_cleanly_when_frame_zero_fails(animation, monkeypatch):
+    monkeypatch.setattr(gd, "get_monitor_layout", lambda: FakeMonitors())
+    host = FakeHost(InlinePool())
+    errors = []
+    desklet = new_desklet(host, animation(fail_at=0), on_error=errors.append)
+    # A falha chega antes do fim do construtor: o desklet se fecha sem deixar rastro
+    assert desklet.closed
+    assert errors == ["broken frame 0"]
+    assert not host.desklets
+    assert not host.frame_store.entries
+
+
+def test_frames_are_never_decoded_above_source_resolution(animation, monkeypatch):
+    path = animation()
+    scaling = gd.FrameScaling(device_scale=2)
+    assert scaling.output_size((32, 8)) == (32, 8)
+    assert gd.FrameScaling(scale=0.5, device_scale=2).output_size((32, 8)) == (32, 8)
+    assert gd.FrameScaling(scale=0.25, device_scale=2).output_size((32, 8)) == (16, 4)
+
+    monitors = FakeMonitors(scale=2)
+    monkeypatch.setattr(gd, "get_monitor_layout", lambda: monitors)
+    host = FakeHost(InlinePool())
+    desklet = new_desklet(host, path)
+    # Num monitor 2x o GIF continua no tamanho do arquivo; o GTK amplia na tela
+    assert desklet.frames.size == (32, 8)
+    assert desklet.logical_size() == (32, 8)
+    assert desklet.pixel_ratio() == (1, 1)
+
+    # Voltar a 1x não reduz nem redecodifica: já está no tamanho lógico
+    monitors.scale = 1
+    desklet.rescale(1)
+    assert desklet.frames.size == (32, 8)
+    assert desklet.pending is None
+    assert len(host.frame_store.entries) == 1
+    desklet.destroy()
+
+
+@pytest.mark.parametrize("name, extension, loop, plays", [
+    # NETSCAPE conta as repetições depois da primeira volta
+    ("gif", ".gif", 2, 3), ("gif", ".gif", None, 1), ("gif", ".gif", 0, None),
+    # num_plays e loop_count já são o total
+    ("apng", ".png", 2, 2), ("apng", ".png", 0, None),
+    ("webp", ".webp", 2, 2), ("webp", ".webp", 0, None),
+])
+def test_decoders_convert_file_loop_counts(tmp_path, name, extension, loop, plays):
+    if name == "webp" and not features.check("webp"):
+        pytest.skip("Pillow built without WebP")
+    path = str(tmp_path / f"anim{extension}")
+    frames = [Image.new("RGBA", (4, 4), color) for color in ((255, 0, 0, 255), (0, 0, 255, 255))]
+    options = {} if loop is None else {"loop": loop}
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=40, **options)
+    info = gd.probe_animation(path)
+    assert info.name == name
+    assert info.plays == plays
+
+
+def test_process_mode_creates_desklet_once_headers_arrive(animation, monkeypatch):
+    require_display()
+    monkeypatch.setattr(gd, "get_monitor_layout", lambda: FakeMonitors())
+    monkeypatch.setattr(gd, "get_system_state", gd.StaticSystemState)
+    pool = DeferredPool(isolated=True)
+    host = FakeHost(pool)
+    settings = {"gif_path": animation(), "disk_cache_mb": "0"}
+    gd.create_desklet("test", settings, host)
+    # O GTK não espera pelo worker: o desklet nasce quando os cabeçalhos chegam
+    assert not host.desklets and host.starting == {"test"}
+    assert [task[1] for task in pool.queue] == [gd.probe_animation]
+    pool.drain()
+    assert not host.starting
+    desklet = host.desklets["test"]
+    assert desklet.frames.size == (32, 8)
+
+    # Um reload para outro GIF também lê os cabeçalhos no worker antes
+    desklet.load_frames(dict(desklet.frame_options, gif_path=animation(frame_count=4)), 1)
+    assert desklet.preparing is not None and desklet.frames.frame_count == 6
+    assert [task[1] for task in pool.queue] == [gd.probe_animation]
+    pool.drain()
+    assert desklet.preparing is None and desklet.frames.frame_count == 4
+    desklet.destroy()
+
+
+def test_probe_retries_crashed_workers_then_reports(animation, monkeypatch):
+    require_display()
+    monkeypatch.setattr(gd, "get_monitor_layout", lambda: FakeMonitors())
+    monkeypatch.setattr(gd, "get_system_state", gd.StaticSystemState)
+
+    class CrashingPool(InlinePool):
+        def __init__(self, crashes):
+            super().__init__(isolated=True)
+            self.crashes = crashes
+            self.probes = 0
+
+        def submit(self, fn, *args, affinity=None):
+            if fn is gd.probe_animation:
+                self.probes += 1
+                if self.probes <= self.crashes:
+                    future = concurrent.futures.Future()
+                    future.set_exception(concurrent.futures.BrokenExecutor("worker died"))
+                    return future
+            return super().submit(fn, *args)
+
+    settings = {"gif_path": animation(), "disk_cache_mb": "0"}
+    # Um worker que morre é substituído, como nos blocos de frames
+    host = FakeHost(CrashingPool(crashes=2))
+    gd.create_desklet("test", settings, host)
+    assert host.frame_store.pool.probes == 3
+    host.desklets["test"].destroy()
+
+    # Depois de MAX_CRASHES tentativas a falha chega a on_error, sem desklet
+    host = FakeHost(CrashingPool(crashes=10))
+    errors = []
+    gd.create_desklet("test", settings, host, on_error=errors.append)
+    assert host.frame_store.pool.probes == gd.FrameSource.MAX_CRASHES + 1
+    assert errors == [f"decode worker crashed {gd.FrameSource.MAX_CRASHES + 1} times"]
+    assert not host.desklets and not host.starting
+
+
+def test_decode_pool_pins_each_gif_to_one_worker():
+    pool = gd.DecodePool("process", workers=2)
+    try:
+        lanes = [pool._lane(path) for path in ("a.gif", "b.gif", "a.gif", "b.gif", "c.gif")]
+        assert lanes == [0, 1, 0, 1, 0]
+        # Um GIF liberado deixa o worker para o próximo
+        pool.forget("b.gif")
+        assert pool._lane("d.gif") == 1
+    finally:
+        pool.shutdown()
+
+
+def test_store_closes_worker_decoders_when_a_gif_is_released(animation):
+    path = animation(frame_count=20)
+    pool = DeferredPool(isolated=True)
+    store = gd.FrameStore(pool)
+    store.prepare(path, lambda error: None)
+    pool.drain()
+    key, frames, _ = store.acquire(path, disk_cache_mb=0)
+    # Só o primeiro bloco: o decodificador aberto pela leitura dos cabeçalhos
+    # continua no "worker", esperando o próximo
+    pool.run(*pool.queue.pop(0))
+    assert len(gd._worker_images) == 1
+    decoder = StubDecoder.instances[-1]
+    assert len(StubDecoder.instances) == 1 and not decoder.closed
+
+    store.release(key)
+    pool.drain()
+    assert not gd._worker_images and decoder.closed == 1
+    # Cabeçalhos, blocos e o fechamento vão para o mesmo worker
+    assert set(pool.affinities) == {path}